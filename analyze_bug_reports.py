@@ -1,11 +1,11 @@
 from git import Repo
 import argparse
-import subprocess
 import os
-from os import listdir
-from os.path import isfile, join
-from utility.bug_report import Bug, BugReport
-from utility.event_report import EventsReport
+from utility.bug_report import LazyBugReport, stored_commit
+from utility.lifetime_tracker import LifetimeTracker
+from utility import sharded_tracker
+from utility.commit_index import CommitIndex
+from utility.report_manifest import get_manifest, LEGACY_PREFIX
 import datetime
 from datetime import timedelta
 import time
@@ -22,179 +22,34 @@ parser.add_argument('-tool', default='cppcheck', help="Static analysis tool to r
 parser.add_argument('-command', default='make', help="Command to compile build")
 parser.add_argument('-clean', default='make clean', help="Command to clean build")
 parser.add_argument('-load', default='', help="Load saved data")
+parser.add_argument('-track', action='store_true', help="Track the lifetime of bugs across the saved reports")
+parser.add_argument('-checkpoint', default=None, help="File to checkpoint bug lifetime tracking to")
+parser.add_argument('-every', type=int, default=10, help="Number of commit steps between checkpoints")
+parser.add_argument('-resume', action='store_true', help="Resume bug lifetime tracking from the checkpoint")
+parser.add_argument('-j', type=int, default=1, help="Number of processes to track bug lifetimes with, sharded by file (no checkpoints)")
 
 
-def check_if_bug_resolved(bug, new_br, d):
+def saved_positions(manifest, index):
     """
-        Given a bug and a bug report, tries to find a matching
-        bug in the new bug report for this bug. If a match is found,
-        then the bug is updated to the matched bug. Otherwise, the
-        bug is considered resolved.
+        Maps the reports of the manifest to commits of the index, instead of
+        looking every commit up in the manifest.
 
-        d: The destination locs of the bug
-        return: Whether or not the bug was resolved.
+        return: sorted positions in index.shas[::-1], where the newest
+                commit comes first, of the commits with a saved report that
+                is not a pickle
     """
-    any_same_bug = False
-    
-    # We know that filename exists in new_br's commit because the
-    # file was modified, not renamed. So the bug must have been 
-    # resolved and there are no bugs in the file in this case. 
-    if bug.fname not in new_br.file_map:
-        return True
-
-
-    for bug_in_fname in new_br.file_map[bug.fname]:
-        same_bug = d[0] <= bug_in_fname.locs[0] <= d[1]
-        same_bug = d[0] <= bug_in_fname.locs[1] <= d[1] and same_bug
-        same_bug = bug_in_fname.desc == bug.desc and same_bug
-        same_bug = bug_in_fname.code == bug.code and same_bug
-
-        # Update the bug 
-        if same_bug:
-            any_same_bug = True
-            bug = bug_in_fname
-            print("Bug match found and updated")
-            break
-
-    resolved = not any_same_bug
-    return resolved
-
-def get_lines_modified(curr_commit, next_commit, fname):
-   """
-        commit: compares HEAD to commit, where commit is AHEAD of HEAD
-        fname : a file which has been changed from HEAD -> commit   
-        return: two non-empty lists of tuples indicating start and end of line
-        changes in source and dest files respectively
-  """
-   srcs = []
-   dsts = []
-   result = subprocess.run(["git", "diff", curr_commit, next_commit, "--", fname], stdout=subprocess.PIPE)
-   
-   # Get the line change info lines
-   lines = result.stdout.decode("utf-8").split("\n")
-   # IPython.embed()
-   lines = filter(lambda x: x.count("@@") == 2, lines)
-   
-   for line in lines:
-      toks = line.split(' ')
-      if len(toks) < 4:
-          continue
-     
-      def get_hunk(src):
-          start = None
-          end = None   
-          if ',' in src:
-             (start, d) = src.split(',')
-             start = int(start)
-             end = start + int(d)
-          elif src.isdigit():
-             start = int(src)
-             end = start
-          else:
-              start = 0
-              end = 0
-          return (start, end)
-
-      src = get_hunk(toks[1][1:])
-      dst = get_hunk(toks[2][1:])
- 
-      srcs.append(src)
-      dsts.append(dst)
-   
-   assert len(srcs) > 0
-   assert len(dsts) > 0
-   return srcs, dsts
-
-def get_files_changed(curr_commit, next_commit):
-    """
-        commit: compares HEAD to commit, where commit is AHEAD of HEAD
-        return: a dictionary from filename to list. List contains the type of
-                change as the first element and additional arguments following
-                it optionally. For example a rename will have an array
-                containing "R" as the first element and the destination filename
-                as the second element, i.e, what the file was renamed to.
-    """
-    # Check if file was modified
-    # Note: HEAD precedes commit because t(HEAD) < t(commit)
-    result = subprocess.run(["git", "diff", curr_commit, next_commit, "--name-status"], stdout=subprocess.PIPE)
-    files_changed = result.stdout.decode("utf-8").split("\n")[:-1]
-   
-    to_return = {}
-
-    # Can't simply check if only the file was changed, because then it will
-    # show a rename as a delete. So, we go through all changes and renames 
-    # appear. 
-    for line in files_changed:
-        out = line.split("\t")
-        status = out[0]
-        f = out[1]
-
-        to_return[f] = []
-        to_return[f].append(status[0])
-        if status[0] == 'R':
-            to_return[f].append(out[2])
-
-    return to_return
-
-def update_unmodified_bug(bug, srcs, dsts):
-    """
-        Given a bug, the method will find the bug in its specified file
-        and update its locs to the nearest found match. If no match,
-        throws an assertion error.
-    """
-    assert srcs[0][0] == dsts[0][0]
-    old_loc = bug.locs[0]
-
-    # Find the first source location > bug loc
-    # i.e the nearest changed hunk preceding this bug
-    end = -1
-    for s in srcs:
-        if s[0] > old_loc:
-            break
-        end += 1
-    
-    # Bug occurred before changes, so it's loc didn't change
-    if(end < 0):
-        return
-
-    delta = dsts[end][1] - srcs[end][1]
-    new_loc = old_loc + delta
-    bug.locs = (new_loc, new_loc)
-
-
-def _update_unmodified_bug(bug):
-    """
-        Given a bug, the method will find the bug in its specified file
-        and update its locs to the nearest found match. If no match,
-        throws an assertion error.
-    """
-    f = open(bug.fname)
-    file_lines = f.read().split('\n')
-    f.close()
-    
-    # Get all matches for bug code
-    matches = []
-    for j in range(len(file_lines)):
-        line = file_lines[j]
-        if bug.code in line:
-            matches.append(j)
-
-    if len(matches) == 0:
-        #list as bug lost for now
-        print("bug lost...")
-        bug_loc = "lost"
-        return
-        #IPython.embed()
-    assert len(matches) > 0, "error: bug lost"
-    bug_loc = matches[0]
-
-    # find the nearest match to the orig line of code
-    if len(matches) > 1:
-        diffs = (lambda val, l: [abs(e - val) for e in l])(bug.locs[0], matches) 
-        bug_loc = matches[diffs.index(min(diffs))]
-
-    # Update bug line of code
-    bug.locs = (bug_loc, bug_loc)
+    manifest.refresh()
+    positions = set()
+    for sha, entry in manifest.entries.items():
+        if entry['file'].endswith(".bin"):
+            continue
+        if len(sha) == LEGACY_PREFIX:
+            # Reports saved under a prefix store the commit they are for
+            sha = stored_commit(manifest.save_dir, entry['file'])
+        p = index.position(sha)
+        if p is not None:
+            positions.add(len(index.shas) - 1 - p)
+    return sorted(positions)
 
 def quick_stats(er):
     bug_stats = {}
@@ -212,11 +67,11 @@ def quick_stats(er):
             bug_stats[bug_desc]['resolved'] += 1
 
     commit_stats = {}
-    for i in range(len(er.resolved_vec)):
-        if er.resolved_vec[i] not in commit_stats:
-            commit_stats[er.resolved_vec[i]] = 1
+    for r in er.resolved_vec.tolist():
+        if r not in commit_stats:
+            commit_stats[r] = 1
         else:
-            commit_stats[er.resolved_vec[i]] += 1
+            commit_stats[r] += 1
     return bug_stats, commit_stats
     
 def save_stats(commit, bug_stats, commit_stats, er, commit_list):
@@ -225,6 +80,7 @@ def save_stats(commit, bug_stats, commit_stats, er, commit_list):
     filename = "report_stats_{}.bin".format(commit)
     pickle.dump(data, open("../breezy/bug_report_stats/"+filename, "wb"))
     print("Saved bug report to {}".format(filename))
+    er.save("../breezy/bug_report_stats/events_{}.npz".format(commit))
 
 def load_stats(commit):
     filename = "report_stats_{}.bin".format(commit)
@@ -249,11 +105,10 @@ if __name__ == '__main__':
         print("Error: {} is not a valid directory".format(save_dir))
         exit(1)
 
-    saved_bug_reports = [f for f in listdir(save_dir) if isfile(join(save_dir, f)) and ".txt" in f]
-    bug_report_hashes = [f.split(".")[0].split("_")[-1] for f in saved_bug_reports]
+    manifest = get_manifest(save_dir)
+    saved_bug_reports = sorted(e['file'] for e in manifest.entries.values() if not e['file'].endswith(".bin"))
 
     print(saved_bug_reports)
-    print(bug_report_hashes)
     
     print("...Checking out repository...")
     os.chdir(args.r)
@@ -261,12 +116,12 @@ if __name__ == '__main__':
     repo.git.checkout(args.b)
 
     print("...Getting full commit hashes...")
-    commits = [repo.head.commit.hexsha]
+    index = CommitIndex(os.getcwd(), args.b)
+    commits = index.shas[::-1]
     saved_commits = [] #in order of oldest to newest
-    for i, c in enumerate(repo.head.commit.iter_parents()):
-        commits.append(c.hexsha)
-        if c.hexsha[:5] in bug_report_hashes:
-            saved_commits.append((i, c.hexsha, c.committed_date))
+    for i in saved_positions(manifest, index):
+        if i >= 1:
+            saved_commits.append((i - 1, commits[i], index.timestamps[len(commits) - 1 - i]))
 
     print(saved_commits)
 
@@ -275,115 +130,40 @@ if __name__ == '__main__':
     print("number of bug reports", len(saved_commits))
 
     for i in range(len(saved_commits)):
-        curr_br = BugReport(saved_commits[i][1], dir=args.r, save_dir=args.s) 
-
-    curr_br = BugReport(saved_commits[0][1], dir=args.r, save_dir=args.s) 
-    new_br = BugReport(saved_commits[1][1], dir=args.r, save_dir=args.s)
+        curr_br = LazyBugReport(saved_commits[i][1], dir=args.r, save_dir=args.s) 
+        curr_br.close()
 
-    bug_list = []
-    bug_list_commit = curr_br.commit
-    if "error" in curr_br.type_map:
-        bug_list = curr_br.type_map["error"]  #specific to clang_firefox
-    er = EventsReport(bug_list)
+    curr_br = LazyBugReport(saved_commits[0][1], dir=args.r, save_dir=args.s) 
+    new_br = LazyBugReport(saved_commits[1][1], dir=args.r, save_dir=args.s)
 
     start_time = time.time() 
 
-    # print()
-    # print("Running static analysis over time on {} starting bugs".format(len(bug_list)))
-    # print("===========")
-    
-    # for i in range(1, len(saved_commits)):
-    #     curr_commit = saved_commits[i-1][1]
-    #     next_commit = saved_commits[i][1]
-    #     print("Commit {} {}/{}".format(curr_commit, i + 1, len(saved_commits)))
-        
-    #     curr_br = BugReport(curr_commit, tool=args.tool, command=args.command, clean=args.clean, dir=args.r, save_dir=args.s) 
-    #     new_br = BugReport(next_commit, tool=args.tool, command=args.command, clean=args.clean, dir=args.r, save_dir=args.s)
-      
-    #     f_changes = get_files_changed(saved_commits[i-1][1], saved_commits[i][1])
-        
-    #     ### Find new bugs ###
-    #     new_bugs = []
-    #     for f_change in f_changes:
-    #         change = f_changes[f_change][0]
-            
-    #         # A file added with bugs in it has new bugs
-    #         if change == "A":
-    #             if f_change in new_br.file_map:
-    #                 new_bugs += new_br.file_map[f_change]
+    if args.track:
+        report_args = dict(tool=args.tool, command=args.command, clean=args.clean, dir=args.r, save_dir=args.s)
+        bug_list = []
+        if "error" in curr_br.type_map:
+            bug_list = curr_br.type_map["error"]  #specific to clang_firefox
 
-    #         if change == "M":
-    #             # A file which previously had no bugs but now has bugs in it has new bugs
-    #             if f_change in new_br.file_map:
-    #                 if f_change not in curr_br.file_map:
-    #                     new_bugs += new_br.file_map[f_change]
-
-    #                 else:
-    #                     curr_br_bugs = curr_br.file_map[f_change]
-    #                     curr_hashes = [hash(c) for c in curr_br_bugs]
-    #                     new_br_bugs = new_br.file_map[f_change]
-    #                     next_hashes = [hash(n) for n in new_br_bugs]
-
-    #                     for idx, n in enumerate(next_hashes):
-    #                         if n not in curr_hashes:
-    #                             new_bugs.append(new_br_bugs[idx])
-
-    #     ### Check for resolved bugs ###
-    #     for idx, bug in enumerate(bug_list):
-    #         # print("Working on bug:", idx, "/", len(bug_list))
-    #         # Ignore bug if it has been resolved
-    #         if er.resolved_vec[idx] != -1:
-    #             continue
-
-    #         if bug.fname not in f_changes:
-    #             continue
-
-    #         change = f_changes[bug.fname][0]
-    #         if change == "R":
-    #             bug.fname = f_changes[bug.fname][1]
-
-    #         if change == "M":
-    #             srcs, dsts = get_lines_modified(saved_commits[i-1][1], saved_commits[i][1], bug.fname)
-               
-    #             # Check if the bug was changed at all in this file. 
-    #             did_bug_ever_change = False
-    #             for j in range(len(srcs)):
-    #                 s = srcs[j]
-    #                 bug_changed = s[0] <= bug.locs[0] <= s[1]
-    #                 bug_changed = s[0] <= bug.locs[1] <= s[1] and bug_changed
-
-    #                 if bug_changed:
-    #                     # print("Bug changed")
-    #                     did_bug_ever_change = True
-
-    #                     # rerun bug checker on specific file and compare 
-    #                     # before and after bug reports
-    #                     d = dsts[j]
-    #                     resolved = check_if_bug_resolved(bug, new_br, d)
-    #                     er.update_resolved(idx, saved_commits[i][0], resolved)
-
-    #             # If the bug didn't change, find it in the changed file
-    #             # and update its new line number.
-    #             if not did_bug_ever_change:
-    #                 # print("Bug didn't change")
-    #                 # update_unmodified_bug(bug)
-    #                 update_unmodified_bug(bug, srcs, dsts)
-    #                 # print("-----------")
-        
-    #     # Add new bugs found in next commit to bug list
-    #     print("New bugs: {}".format(len(new_bugs)))
-    #     bug_list += new_bugs
-    #     er.resolved_vec += [-1 for _ in range(len(new_bugs))]
-    #     print("===========") 
-    # bug_stats, commit_stats = quick_stats(er)
-    # save_stats(bug_list_commit, bug_stats, commit_stats, er, commits)
+        if args.j > 1:
+            er = sharded_tracker.track(saved_commits, bug_list, report_args, workers=args.j)
+        else:
+            if args.resume and args.checkpoint is not None and os.path.exists(args.checkpoint):
+                tracker = LifetimeTracker.load(args.checkpoint, saved_commits, report_args)
+            else:
+                tracker = LifetimeTracker(saved_commits, bug_list, report_args)
+            tracker.run(args.checkpoint, args.every)
+            er = tracker.er
+
+        bug_stats, commit_stats = quick_stats(er)
+        save_stats(saved_commits[0][1], bug_stats, commit_stats, er, commits)
     
     print("Wall time: {}".format(str(timedelta(seconds=time.time() - start_time)))) 
     
     res_commits = []
     for i,c,d in list(set(saved_commits)):
-        curr_br = BugReport(c, tool=args.tool, command=args.command, clean=args.clean, dir=args.r, save_dir=args.s)
-        res_commits.append((c, len(curr_br.bugs), d))
+        curr_br = LazyBugReport(c, tool=args.tool, command=args.command, clean=args.clean, dir=args.r, save_dir=args.s)
+        res_commits.append((c, curr_br.num_bugs(), d))
+        curr_br.close()
 
     res_commits = sorted(res_commits, key=lambda x: x[2])
     res_commits = [(c,l,datetime.datetime.fromtimestamp(d).strftime('%c')) for c,l,d in res_commits]
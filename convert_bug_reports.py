@@ -0,0 +1,64 @@
+import argparse
+import os
+import time
+from datetime import timedelta
+from utility.bug_report import BugReport
+from utility import report_store
+from utility.report_manifest import get_manifest
+
+#python3 convert_bug_reports.py clang_save minerva_save archive_clang_bug_reports
+
+parser = argparse.ArgumentParser(description="This program converts saved repr()/pickle bug reports to the columnar format.")
+parser.add_argument('dirs', nargs='+', help="Directories containing saved bug reports")
+parser.add_argument('-f', action='store_true', help="Overwrite columnar reports that already exist")
+
+
+def legacy_reports(save_dir):
+    """
+        Returns the legacy bug report files in save_dir, one per report. The
+        repr() .txt file wins over the pickled .bin file when both exist, and
+        empty files are skipped.
+    """
+    reports = {}
+    for f in sorted(os.listdir(save_dir)):
+        name, ext = os.path.splitext(f)
+        if not name.startswith("bug_report_") or ext not in (".txt", ".bin"):
+            continue
+        if os.path.getsize(os.path.join(save_dir, f)) == 0:
+            continue
+        if name not in reports or ext == ".txt":
+            reports[name] = f
+    return reports
+
+def convert(save_dir, force=False):
+    converted = 0
+    for name, f in legacy_reports(save_dir).items():
+        br = BugReport(name[len("bug_report_"):], dir=None, save_dir=save_dir, compile_bugs=True)
+        path = os.path.join(save_dir, f)
+        if f.endswith(".txt"):
+            with open(path, "r") as txt:
+                br._load_parser(txt.read())
+        else:
+            br._load_pickle(path)
+
+        # Saved under the full commit the report stores, like new reports,
+        # so it is found without the 5 character prefix
+        out = os.path.join(save_dir, "bug_report_{}.brc".format(br.commit))
+        if os.path.exists(out) and not force:
+            continue
+        report_store.write_report(br, out)
+        get_manifest(save_dir).add(br.commit, os.path.basename(out), br.tool, len(br.bugs))
+        converted += 1
+        print("Converted {} ({} bugs) to {}".format(f, len(br.bugs), os.path.basename(out)))
+    return converted
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    start_time = time.time()
+    for save_dir in args.dirs:
+        if not os.path.isdir(save_dir):
+            print("Error: {} is not a valid directory".format(save_dir))
+            exit(1)
+        n = convert(save_dir, args.f)
+        print("{} bug reports converted in {}".format(n, save_dir))
+    print("Wall time: {}".format(str(timedelta(seconds=time.time() - start_time))))
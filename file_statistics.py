@@ -12,9 +12,8 @@ import mplcursors
 import datetime
 from datetime import timedelta
 import matplotlib.pyplot as plt
-
-import sys
-sys.setrecursionlimit(100000)
+from utility.git_backend import get_backend
+from utility.commit_index import CommitIndex
 
 parser = argparse.ArgumentParser(description="...")
 parser.add_argument('-r', required=True, help="Path to repository")
@@ -28,50 +27,38 @@ parser.add_argument('-gran', default='overall', help="Granularity of file statis
 
 file_stats = []
 
-def get_repo_commits(repo):
+def get_repo_commits(index):
     """
-        Given a repository, returns a list of commit hashes.
+        Given a commit index, returns a list of commit hashes.
 
-        repo: The path to the target repository
-        return: List of commit hashes (strings)
+        index: CommitIndex of the target repository
+        return: List of first-parent commit hashes (strings), oldest first
     """
-    #commits = [c.hexsha list(repo.iter_commits(reverse=True))]
+    return index.shas
 
-    commits = [repo.head.commit]
-    curr_commit = repo.head.commit
-    while len(curr_commit.parents) > 0:
-        commits.append(curr_commit.parents[0])
-        curr_commit = curr_commit.parents[0]
-    commits.reverse()
-    return commits
-
-def get_repo_commit_times(repo, commits):
+def get_repo_commit_times(index):
     """
-        Given a repository, returns a map of commit hashes to 
+        Given a commit index, returns a map of commit hashes to 
         datetime.
 
-        repo: The path to the target repository
+        index: CommitIndex of the target repository
         return: Map of commit hashes to datetime (strings)
     """
     mapping = {}
-    for i, c in enumerate(commits):
-        mapping[c.hexsha] = datetime.datetime.fromtimestamp(c.committed_date).strftime('%c')
+    for sha, t in zip(index.shas, index.timestamps):
+        mapping[sha] = datetime.datetime.fromtimestamp(t).strftime('%c')
 
     return mapping
 
-def get_repo_commit_messages(repo, commits):
+def get_repo_commit_messages(index):
     """
-        Given a repository, returns a map of commit hashes to 
+        Given a commit index, returns a map of commit hashes to 
         commit messages.
 
-        repo: The path to the target repository
+        index: CommitIndex of the target repository
         return: Map of commit hashes to commit messages (strings)
     """
-    maessages = {}
-    for i, c in enumerate(commits):
-        maessages[c.hexsha] = c.message
-
-    return maessages
+    return dict(zip(index.shas, index.messages()))
 
 def get_lines_changed_between_commits(repo, curr_commit, next_commit):
     """
@@ -83,8 +70,7 @@ def get_lines_changed_between_commits(repo, curr_commit, next_commit):
 
     global file_stats
     print("commit hash", next_commit)
-    result = subprocess.run(["git", "diff", curr_commit, next_commit, "--shortstat"], stdout=subprocess.PIPE)
-    line_change_stats = result.stdout.decode("utf-8").split("\n")[:-1]
+    line_change_stats = get_backend().shortstat(curr_commit, next_commit)
     if not line_change_stats:
         line_change_stats = ['0 file changed', '0 insertions(+)', '0 deletions(-)']
     file_stats += [(curr_commit, next_commit)] + line_change_stats
@@ -92,8 +78,7 @@ def get_lines_changed_between_commits(repo, curr_commit, next_commit):
 def get_per_directory_statistics(repo, curr_commit, next_commit, mapping, messages):
     global file_stats
     print("commit hash", next_commit)
-    result = subprocess.run(["git", "diff", "--numstat", curr_commit, next_commit], stdout=subprocess.PIPE)
-    dir_change_stats = [x.split("\t") for x in result.stdout.decode("utf-8").split("\n")[:-1]]
+    dir_change_stats = get_backend().numstat(curr_commit, next_commit)
     file_stats += [(curr_commit, mapping[curr_commit], messages[curr_commit], next_commit, mapping[next_commit], messages[next_commit])] + [dir_change_stats]
 
 def get_file_statistics():
@@ -108,10 +93,10 @@ def get_file_statistics():
     print("...checking out repository...")
     repo.git.checkout(args.b)
 
-    commits = get_repo_commits(repo)
-    mapping = get_repo_commit_times(repo, commits)
-    messages = get_repo_commit_messages(repo, commits)
-    commits = [c.hexsha for c in commits]
+    index = CommitIndex(os.getcwd(), args.b)
+    commits = get_repo_commits(index)
+    mapping = get_repo_commit_times(index)
+    messages = get_repo_commit_messages(index)
 
     inc = int(args.step)
     start = max(0, int(args.start))
@@ -2,6 +2,9 @@ from git import Repo
 import argparse
 import os
 from utility.bug_report import Bug, BugReport
+from utility.commit_index import CommitIndex
+from utility.worktree_pool import generate_parallel
+from utility.result_cache import open_cache
 from datetime import timedelta
 import time
 
@@ -14,6 +17,13 @@ parser.add_argument('-step', default=1, help="Number of commits to step by")
 parser.add_argument('-tool', default='cppcheck', help="Static analysis tool to run")
 parser.add_argument('-command', default='make', help="Command to compile build")
 parser.add_argument('-clean', default='make clean', help="Command to clean build")
+parser.add_argument('-clang_format', default='html', choices=['html', 'plist', 'sarif'], help="scan-build output to read bugs from (clang_firefox)")
+parser.add_argument('-i', action='store_true', help="Analyze incrementally on top of the previous report (cppcheck, clang_firefox, infer)")
+parser.add_argument('-cache', default=None, help="Local directory to cache analysis results in, shared by commits with the same content")
+parser.add_argument('-shared_cache', default=None, help="Directory on a shared filesystem to cache analysis results in, shared by all machines")
+parser.add_argument('-cache_size', default=4, help="Size bound of the local cache in GB")
+parser.add_argument('-j', default=1, help="Number of bug reports to generate in parallel, each in its own git worktree")
+parser.add_argument('-w', default=None, help="Directory to keep the worktrees in (default: <repo>-worktrees)")
 
 if __name__ == '__main__':
     args = parser.parse_args()
@@ -31,20 +41,34 @@ if __name__ == '__main__':
     repo = Repo(os.getcwd())
     repo.git.checkout(args.b)
 
-    commits = [repo.head.commit.hexsha]
-    for c in repo.head.commit.iter_parents():
-        commits.append(c.hexsha)
+    # Newest first, commits[0] is the head of the branch
+    commits = CommitIndex(os.getcwd(), args.b).shas[::-1]
     # Get the bug report for the starting commit
     start = int(args.d)
     step = min(-1*int(args.step), int(args.step))
     start_time = time.time()
-    for i in range(start, 0, step):
-        repo.git.checkout(commits[i])
-        print("Generating Bug Reports for Commit {} {}/{}".format(commits[i][:5], start - i + 1, start))
-        
-        br = BugReport(commits[i], tool=args.tool, 
-            command=args.command, clean=args.clean, dir=args.r, save_dir=save_dir)
-        print("===========")
+    cache = open_cache(args.cache and os.path.abspath(args.cache),
+        args.shared_cache and os.path.abspath(args.shared_cache), int(float(args.cache_size) * (1 << 30)))
+    workers = int(args.j)
+    if workers > 1:
+        if not save_br:
+            print("Error: -j requires -s to save the bug reports to")
+            exit(1)
+        # Oldest first, like the serial loop below
+        to_generate = [commits[i] for i in range(start, 0, step)]
+        generate_parallel(os.getcwd(), to_generate, workers, save_dir, args.tool,
+            args.command, args.clean, worktree_root=args.w, incremental=args.i,
+            clang_format=args.clang_format, cache=cache)
+    else:
+        br = None
+        for i in range(start, 0, step):
+            repo.git.checkout(commits[i])
+            print("Generating Bug Reports for Commit {} {}/{}".format(commits[i][:5], start - i + 1, start))
+            
+            br = BugReport(commits[i], tool=args.tool, 
+                command=args.command, clean=args.clean, dir=args.r, save_dir=save_dir,
+                prev_br=br if args.i else None, clang_format=args.clang_format, cache=cache)
+            print("===========")
     print("Done!")
     print("{} bug reports generated for commits {} through {}, saved to {}".format(start, commits[start][:5], commits[0][:5], args.s))
     print("Wall time: {}".format(str(timedelta(seconds=time.time() - start_time)))) 
@@ -0,0 +1,164 @@
+"""
+    Index of the live bugs of a lifetime analysis by file and location, so
+    the bugs a hunk touches are found without checking every bug of the
+    file against every hunk.
+
+    Each file keeps the spans of its bugs sorted by first line, along with
+    the longest span in the file. The bugs overlapping lines [a, b] all
+    start in [a - longest span, b], a range found with two binary searches,
+    so a query costs O(log n + k) for the k bugs it returns as long as bug
+    spans are short, which they are: most bugs are a single line.
+"""
+import numpy as np
+
+
+class FileIndex:
+    """
+        The bugs of one file.
+
+        starts, ends: first and last line of every bug, sorted by start
+        ids: the index in the bug list of every bug
+    """
+    def __init__(self):
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.max_span = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _set(self, starts, ends, ids):
+        order = np.argsort(starts, kind='stable')
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.ids = ids[order]
+        self.max_span = int((self.ends - self.starts).max()) if len(self.ids) else 0
+
+    def add(self, starts, ends, ids):
+        self._set(np.concatenate((self.starts, starts)),
+                  np.concatenate((self.ends, ends)),
+                  np.concatenate((self.ids, ids)))
+
+    def discard(self, ids):
+        keep = ~np.isin(self.ids, ids)
+        self._set(self.starts[keep], self.ends[keep], self.ids[keep])
+
+    def overlapping(self, first, last):
+        """
+            return: positions in the index of the bugs overlapping lines
+                    first to last
+        """
+        lo = np.searchsorted(self.starts, first - self.max_span, side='left')
+        hi = np.searchsorted(self.starts, last, side='right')
+        return lo + np.flatnonzero(self.ends[lo:hi] >= first)
+
+
+class BugIndex:
+    """
+        The live bugs of a bug list by file. Bugs are referred to by their
+        index in the bug list.
+    """
+    def __init__(self, bug_list=(), ids=None):
+        self.files = {}
+        if ids is None:
+            ids = range(len(bug_list))
+        self.add(bug_list, ids)
+
+    def __contains__(self, fname):
+        return fname in self.files
+
+    def __len__(self):
+        return sum(len(f) for f in self.files.values())
+
+    def add(self, bugs, ids):
+        """
+            Indexes bugs under the given ids, a batch per file.
+        """
+        by_file = {}
+        for bug, idx in zip(bugs, ids):
+            by_file.setdefault(bug.fname, []).append((bug.loc_start, bug.loc_end, idx))
+        for fname, rows in by_file.items():
+            rows = np.array(rows, dtype=np.int64)
+            if fname not in self.files:
+                self.files[fname] = FileIndex()
+            self.files[fname].add(rows[:, 0], rows[:, 1], rows[:, 2])
+
+    def discard(self, fname, ids):
+        """
+            Removes the bugs of fname with the given ids, e.g. once resolved.
+        """
+        if fname not in self.files or len(ids) == 0:
+            return
+        self.files[fname].discard(np.asarray(ids, dtype=np.int64))
+        if len(self.files[fname]) == 0:
+            del self.files[fname]
+
+    def rename(self, old, new, bug_list):
+        """
+            Moves the bugs of old to new, renaming the bugs as well.
+        """
+        if old not in self.files:
+            return
+        index = self.files.pop(old)
+        for idx in index.ids:
+            bug_list[idx].fname = new
+        if new in self.files:
+            self.files[new].add(index.starts, index.ends, index.ids)
+        else:
+            self.files[new] = index
+
+    def ids(self, fname):
+        return self.files[fname].ids if fname in self.files else np.zeros(0, dtype=np.int64)
+
+    def overlapping(self, fname, first, last):
+        """
+            return: ids of the bugs of fname overlapping lines first to last
+        """
+        if fname not in self.files:
+            return np.zeros(0, dtype=np.int64)
+        index = self.files[fname]
+        return index.ids[index.overlapping(first, last)]
+
+    def touched(self, fname, line_map):
+        """
+            Finds the bugs of fname each hunk of line_map touches. A hunk
+            replacing lines s to e touches the bugs overlapping them, and a
+            pure insertion after line s the bugs spanning both s and s + 1.
+
+            return: list of (hunk, ids of the bugs it touches), for the
+                    hunks touching any bug
+        """
+        if fname not in self.files:
+            return []
+        index = self.files[fname]
+        to_return = []
+        for k in range(len(line_map)):
+            start, count = int(line_map.old_start[k]), int(line_map.old_count[k])
+            if count == 0:
+                pos = index.overlapping(start, start)
+                pos = pos[index.ends[pos] > start]
+            else:
+                pos = index.overlapping(start, start + count - 1)
+            if len(pos):
+                to_return.append((k, index.ids[pos]))
+        return to_return
+
+    def remap(self, fname, line_map, bug_list):
+        """
+            Moves the bugs of fname to their lines in the next commit, and
+            updates their locs in bug_list to match. Bugs inside a hunk are
+            moved into the new side of the hunk. Line mapping keeps the order
+            of the bugs, so the index stays sorted.
+        """
+        if fname not in self.files:
+            return
+        index = self.files[fname]
+        starts, ends, _, _ = line_map.remap(index.starts, index.ends)
+        for idx, start, end in zip(index.ids.tolist(), starts.tolist(), ends.tolist()):
+            bug_list[idx].locs = (start, end)
+        if len(starts) > 1 and (np.diff(starts) < 0).any():
+            index._set(starts, ends, index.ids)
+        else:
+            index.starts, index.ends = starts, ends
+            index.max_span = int((ends - starts).max()) if len(ends) else 0
@@ -1,50 +1,259 @@
 import subprocess
 import os
+import sys
+import hashlib
 import pickle 
+import re
+import tempfile
+import time
+import multiprocessing
 from utility import format_infer
 from utility import format_clang
+from utility import format_plist
+from utility import format_sarif
+from utility import report_store
+from utility.report_manifest import get_manifest
+from utility import result_cache
+from utility.git_backend import get_backend
 import IPython
 import ast
+from collections.abc import Mapping
+
+# What cppcheck checks as a translation unit, and what only gets included.
+CPPCHECK_SOURCES = (".c", ".cc", ".cpp", ".cxx", ".c++", ".tpp", ".txx")
+CPPCHECK_HEADERS = (".h", ".hh", ".hpp", ".hxx", ".h++", ".inc", ".ipp")
+# cppcheck output template. Findings start with a record separator and their
+# fields are split by unit separators, neither of which appear in paths or
+# messages, so paths with colons parse correctly.
+CPPCHECK_START = "\x1e"
+CPPCHECK_SEP = "\x1f"
+CPPCHECK_TEMPLATE = CPPCHECK_START + CPPCHECK_SEP.join(
+    ["{file}", "{line}", "{column}", "{severity}", "{id}", "{message}"]) + "\\n{code}"
+
+# Executable whose version goes into the cache key of each tool's reports
+TOOL_EXECUTABLES = {"cppcheck": "cppcheck", "cppcheck_tu": "cppcheck", "infer": "infer",
+                    "clang_firefox": "clang", "clang_tu": "clang"}
+
+# Object dir of the Firefox build in .mozconfig, per checkout or worktree
+CLANG_OBJ_DIR = "obj-ff-dbg"
+INFER_OUT_DIR = "infer-out"
+BUILD_DIR_COMMIT = ".breezy_commit"
+
+
+def _build_dir_commit(build_dir):
+    """
+        return: the commit a build (or infer-out) dir was last built at, or None
+    """
+    try:
+        with open(os.path.join(build_dir, BUILD_DIR_COMMIT), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _mark_build_dir(build_dir, commit):
+    if os.path.isdir(build_dir):
+        with open(os.path.join(build_dir, BUILD_DIR_COMMIT), "w") as f:
+            f.write(commit)
+
+_stored_commits = {}
+
+def stored_commit(save_dir, name):
+    """
+        return: the full commit recorded in the metadata of the saved report
+                save_dir/name. Reports are read once per process.
+    """
+    path = os.path.join(save_dir, name)
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key not in _stored_commits:
+        if name.endswith(".brc"):
+            mapped = report_store.MappedReport(path)
+            commit = mapped.meta['commit']
+            mapped.close()
+        elif name.endswith(".txt"):
+            with open(path, "r") as f:
+                commit = ast.literal_eval(f.read())['commit']
+        else:
+            with open(path, "rb") as f:
+                commit = _LegacyUnpickler(f).load()['commit']
+        _stored_commits[key] = str(commit)
+    return _stored_commits[key]
+
+def _breezy_dir(which):
+    """
+        return: the directory our files are kept in inside the git dir, the
+                worktree's own one for "--git-dir" and the one shared by all
+                worktrees for "--git-common-dir"
+    """
+    result = subprocess.run(["git", "rev-parse", which], stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    git_dir = result.stdout.decode("utf-8").strip() if result.returncode == 0 else "."
+    return os.path.join(git_dir, "breezy")
+
+def _rebuilt_files(obj_dir, since):
+    """
+        Reads the make dependency files (.deps/*.pp) written since a time,
+        i.e. those of the translation units that were recompiled.
+
+        return: set of the sources and headers they depend on, relative to
+                the current directory
+    """
+    root = os.getcwd()
+    files = set()
+    for dirpath, dirnames, filenames in os.walk(obj_dir):
+        if os.path.basename(dirpath) != ".deps":
+            continue
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if not name.endswith(".pp") or os.path.getmtime(path) < since:
+                continue
+            with open(path, "r", errors="replace") as f:
+                deps = f.read().replace("\\\n", " ")
+            for line in deps.split("\n"):
+                if ":" not in line:
+                    continue
+                for dep in re.split(r"(?<!\\)\s+", line.split(":", 1)[1].strip()):
+                    if not dep:
+                        continue
+                    dep = os.path.normpath(os.path.join(root, dep.replace("\\ ", " ")))
+                    files.add(os.path.relpath(dep, root) if dep.startswith(root + os.sep) else dep)
+    return files
 
 
 class Bug:
     """
         A bug is defined by the file it lives in, the commit that it is in,
         it's description and lines of code
-    """
-    def __init__(self, fname, desc, code, bug_type, severity, locs, commit):
-        self.fname = fname
-        self.desc = desc
-        self.code = code
-        self.bug_type = bug_type
-        self.severity = severity
-        self.locs = locs
-        self.commit = commit
 
-    def __hash__(self):
+        Bugs are kept compact since a report holds thousands of them: there is
+        no per-instance __dict__, locs is stored as two ints, and the fields
+        that repeat across bugs (fname, desc, bug_type, severity, commit) are
+        interned so every bug shares one copy of each distinct string.
+
+        notes: the path of events leading to the bug as (file, line, message)
+               tuples, for the tools that report one, or None
+    """
+    __slots__ = ("_fname", "desc", "code", "bug_type", "severity",
+                 "loc_start", "loc_end", "commit", "fingerprint", "notes")
+
+    def __init__(self, fname, desc, code, bug_type, severity, locs, commit, fingerprint=None, notes=None):
+        self._fname = sys.intern(str(fname))
+        self.desc = sys.intern(str(desc))
+        self.code = str(code)
+        self.bug_type = sys.intern(str(bug_type))
+        self.severity = sys.intern(str(severity))
+        self.loc_start = int(locs[0])
+        self.loc_end = int(locs[1])
+        self.commit = sys.intern(str(commit))
+        if fingerprint is None:
+            fingerprint = self.compute_fingerprint()
+        self.fingerprint = fingerprint
+        self.notes = tuple((str(f or ""), int(l or 0), str(m or "")) for f, l, m in notes) if notes else None
+
+    @property
+    def fname(self):
+        return self._fname
+
+    @fname.setter
+    def fname(self, fname):
+        # The file is part of a bug's identity, so a rename changes it.
+        self._fname = sys.intern(str(fname))
+        self.fingerprint = self.compute_fingerprint()
+
+    @property
+    def locs(self):
+        return (self.loc_start, self.loc_end)
+
+    @locs.setter
+    def locs(self, locs):
+        self.loc_start = int(locs[0])
+        self.loc_end = int(locs[1])
+
+    def compute_fingerprint(self, fname=None):
         """
-            Note: this hash function explicitly does NOT take into account bug location.
+            Note: the fingerprint explicitly does NOT take into account bug location.
             It's purpose is to identify bugs that have moved around in code by modification
             of other pieces of code, not the bug itself. Therefore, a bug's identity is somewhat
             location independent.
+
+            The fingerprint is a 64 bit BLAKE2b digest of the whitespace normalized
+            fname, desc, code, bug_type and severity. Unlike hash() of a str it is
+            the same in every process, so it is saved with the report and can be
+            compared across runs and workers.
+
+            fname: compute the fingerprint this bug would have in another file,
+                   e.g. the destination of a rename
         """
-        to_return = 0
-        to_return ^= hash(self.fname)
-        to_return ^= hash(self.desc)
-        to_return ^= hash(self.code)
-        to_return ^= hash(self.bug_type)
-        to_return ^= hash(self.severity)
-        return to_return
+        h = hashlib.blake2b(digest_size=8)
+        if fname is None:
+            fname = self._fname
+        for field in (fname, self.desc, self.code, self.bug_type, self.severity):
+            data = " ".join(field.split()).encode("utf-8", "surrogatepass")
+            h.update(len(data).to_bytes(4, "little"))
+            h.update(data)
+        return int.from_bytes(h.digest(), "little")
+
+    def __hash__(self):
+        return self.fingerprint
+
+    def to_dict(self):
+        d = {
+            'fname': self.fname,
+            'desc': self.desc,
+            'code': self.code,
+            'bug_type': self.bug_type,
+            'severity': self.severity,
+            'locs': self.locs,
+            'commit': self.commit,
+        }
+        if self.notes is not None:
+            d['notes'] = self.notes
+        return d
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        # Bugs pickled before __slots__ carry their __dict__, which has the
+        # same keys as to_dict().
+        if isinstance(state, tuple):
+            state = state[1]
+        Bug.__init__(self, state['fname'], state['desc'], state['code'], state['bug_type'],
+            state['severity'], state['locs'], state['commit'], notes=state.get('notes'))
+
+class _LegacyString(str):
+    pass
+
+class _LegacyObject:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """
+        Older pickled reports refer to this module as bug_report or
+        utility.bug_report depending on where they were generated from, and
+        some hold BeautifulSoup strings (with their whole parse tree) instead
+        of plain strings. Those are loaded as inert stand-ins.
+    """
+    def find_class(self, module, name):
+        if module in ("bug_report", "utility.bug_report"):
+            return globals()[name]
+        if module.split(".")[0] == "bs4":
+            return _LegacyString if name == "NavigableString" else _LegacyObject
+        return super().find_class(module, name)
 
 class BugReport:
     """
         A bug report stores a list of bugs for a given commit of a repo, or
         for a specified filename
     """
-    def __init__(self, commit, dir, tool="cppcheck", command="cppcheck", clean="make clean", fname=None, save_dir=None, compile_bugs=False):
+    def __init__(self, commit, dir, tool="cppcheck", command="cppcheck", clean="make clean", fname=None, save_dir=None, compile_bugs=False, prev_br=None, clang_format="html", cache=None):
         self.commit = commit
         self.bugs = []
         self.type_map = {}
@@ -55,55 +264,161 @@ class BugReport:
         self.dir = dir
         self.fname = fname
         self.save_dir = save_dir
+        # Report of an earlier commit to analyze incrementally from, if any
+        self.prev_br = prev_br
+        # scan-build output to ingest for clang_firefox: html, plist or sarif
+        self.clang_format = clang_format
+        # result_cache of whole reports (and of TU findings), shared by any
+        # commits with the same tree
+        self.cache = cache
         self.br_file = "bug_report_{}.bin".format(self.commit[:5])
         self.br_txtfile = "bug_report_{}.txt".format(self.commit[:5])
+        # Reports are saved under the full hash, see report_manifest
+        self.br_colfile = "bug_report_{}.brc".format(self.commit)
         if not compile_bugs:
             self.get_bugs()
 
     def __repr__(self):
         return str(self.__dict__)
 
+    def num_bugs(self):
+        return len(self.bugs)
+
+    def fingerprints(self, fname):
+        """
+            return: the fingerprints of the bugs in fname
+        """
+        return [bug.fingerprint for bug in self.file_map.get(fname, [])]
+
+    def bugs_at(self, fname, positions):
+        """
+            return: the bugs at the given positions among the bugs of fname,
+                    in the order of fingerprints(fname)
+        """
+        bugs = self.file_map.get(fname, [])
+        return [bugs[k] for k in positions]
+
+    def _add_bug(self, bug, type_key):
+        self.bugs.append(bug)
+
+        if type_key not in self.type_map:
+            self.type_map[type_key] = []
+        self.type_map[type_key].append(bug)
+
+        if bug.fname not in self.file_map:
+            self.file_map[bug.fname] = []
+        self.file_map[bug.fname].append(bug)
+
     def cppcheck(self, run_dir):
-        result = subprocess.run(["cppcheck", "--enable=all", "--inconclusive",
-            "--quiet", run_dir], stderr=subprocess.PIPE)
-        
-        t = {} 
-        # Parse bugs
-        to_parse = result.stderr.decode("utf-8").split("\n")
-
-        i = 0
-        while i < len(to_parse):
-            if '^' in to_parse[i]:
-                i += 1
+        for bug in self._run_cppcheck([run_dir]):
+            self._add_bug(bug, bug.bug_type)
+
+    def cppcheck_incremental(self, run_dir, prev_br):
+        """
+            Builds this report from prev_br, the report of an earlier commit.
+            cppcheck's whole program checks (unusedFunction, CTU) look at
+            every file, so checking only the changed files would not give
+            the findings of a full run. Instead all of run_dir is checked
+            again, and cppcheck's build dir, which keeps its per-file results
+            between runs as in deprecated/cppcheck.py, only re-analyzes the
+            files whose content changed.
+
+            When no source or header changed, the findings of prev_br are
+            carried forward without running cppcheck.
+        """
+        diff = get_backend(".").diff_index(prev_br.commit, self.commit)
+        changed = [p for fd in diff.files.values() for p in (fd.old_path, fd.new_path)
+                   if p.endswith(CPPCHECK_SOURCES + CPPCHECK_HEADERS)]
+        if changed:
+            print("...{} sources changed since {}, running cppcheck on {}...".format(
+                len(set(changed)), prev_br.commit[:5], run_dir))
+            self.cppcheck(run_dir)
+            return
+
+        self._carry_forward(prev_br, diff)
+        print("...No sources changed, carried {} bugs forward from {}...".format(
+            len(self.bugs), prev_br.commit[:5]))
+
+    def _carry_forward(self, prev_br, diff, recheck=(), type_key="bug_type"):
+        """
+            Copies the bugs of prev_br into this report, except for the bugs
+            of files that were deleted or edited in diff, or are in recheck.
+            A file renamed without edits keeps its bugs under the new name.
+
+            type_key: the Bug attribute the tool files bugs in type_map by
+            return: set of (fingerprint, locs) of the carried bugs
+        """
+        renamed = {f: fd.new_path for f, fd in diff.files.items() if fd.status == 'R' and not fd.hunks}
+        carried = set()
+        for fname, bugs in prev_br.file_map.items():
+            if fname in renamed:
+                new_fname = renamed[fname]
+            elif fname in diff:
+                continue
+            else:
+                new_fname = fname
+            if new_fname in recheck:
                 continue
-            err = to_parse[i].split(':')
-            code = ""
-            fname = err[0]
-            line_no = int(err[1])
-            pos = int(err[2])
-            bug_type = err[3][1:]
-            desc = err[4][1:]
-
-            next_carat = 0
-            carat_found = False
-            while not carat_found:
-                next_carat += 1
-                carat_found = '^' in to_parse[next_carat]
-                if not carat_found:
-                    code += to_parse[next_carat]
-       
-            i += next_carat + 1
-            
-            bug = Bug(fname, desc, code, bug_type, bug_type, (line_no, line_no), self.commit)
-            self.bugs.append(bug)
-
-            if bug_type not in self.type_map:
-                self.type_map[bug_type] = []
-            self.type_map[bug_type].append(bug)
-
-            if fname not in self.file_map:
-                self.file_map[fname] = []
-            self.file_map[fname].append(bug)
+            for bug in bugs:
+                fingerprint = bug.fingerprint if new_fname == bug.fname else None
+                carry = Bug(new_fname, bug.desc, bug.code, bug.bug_type, bug.severity,
+                    bug.locs, self.commit, fingerprint, bug.notes)
+                carried.add((carry.fingerprint, carry.locs))
+                self._add_bug(carry, getattr(carry, type_key))
+        return carried
+
+    def _cppcheck_build_dir(self):
+        # The build dir lives in the (per worktree) git dir, out of the way of
+        # the checkout and of other workers.
+        build_dir = os.path.join(_breezy_dir("--git-dir"), "cppcheck-build-dir")
+        os.makedirs(build_dir, exist_ok=True)
+        return build_dir
+
+    def _run_cppcheck(self, targets):
+        """
+            Runs cppcheck on targets (directories or files) and yields the
+            bugs it finds while it is still running. Findings are read from
+            the pipe as cppcheck writes them, so only the finding being
+            parsed is held in memory.
+        """
+        build_dir = self._cppcheck_build_dir()
+        file_list = None
+        if len(targets) > 1:
+            # Not in the build dir, where cppcheck keeps its own files.txt
+            with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+                f.write("\n".join(targets) + "\n")
+                file_list = f.name
+            targets = ["--file-list=" + file_list]
+        proc = subprocess.Popen(["cppcheck", "--enable=all", "--inconclusive",
+            "--quiet", "--cppcheck-build-dir=" + build_dir,
+            "--template=" + CPPCHECK_TEMPLATE] + targets,
+            stderr=subprocess.PIPE, encoding="utf-8", errors="replace")
+        try:
+            finding = None
+            for line in proc.stderr:
+                line = line.rstrip("\n")
+                if line.startswith(CPPCHECK_START):
+                    if finding is not None:
+                        yield self._cppcheck_bug(*finding)
+                    finding = (line[len(CPPCHECK_START):].split(CPPCHECK_SEP, 5), [])
+                elif finding is not None and line.strip() != "^":
+                    # {code} is the source line followed by a caret line
+                    finding[1].append(line)
+            if finding is not None:
+                yield self._cppcheck_bug(*finding)
+        finally:
+            proc.stderr.close()
+            proc.wait()
+            if file_list is not None:
+                os.remove(file_list)
+
+    def _cppcheck_bug(self, fields, code):
+        fname, line_no, column, severity, bug_id, message = fields
+        # Descriptions have always ended with the check id, as in cppcheck's
+        # default output.
+        desc = "{} [{}]".format(message, bug_id)
+        line_no = int(line_no)
+        return Bug(fname, desc, "".join(code), severity, severity, (line_no, line_no), self.commit)
            
     def infer(self):
         #remove previous instance of infer output if there is 
@@ -111,33 +426,71 @@ class BugReport:
         #     for i in glob.glob(os.path.join("./infer-out", '*')):
         #         shutil.rmtree("./infer-out")
 
+        # infer-out can only be reused if it was last analyzed at the commit
+        # of the report we carry bugs forward from.
+        if self.prev_br is not None and _build_dir_commit(INFER_OUT_DIR) == self.prev_br.commit:
+            self.infer_reactive(self.prev_br)
+            return
+
         #clean build before running infer
         result = subprocess.run(self.clean.split())
         #run infer 
         result = subprocess.run(self.command.split())
+        _mark_build_dir(INFER_OUT_DIR, self.commit)
 
         #format infer_out file
         list_of_bugs = format_infer.format(self.dir)
         for caught_bug in list_of_bugs:
-            lineno = caught_bug['line']
-            bug = Bug(caught_bug['file'], 
-                    caught_bug['qualifier'], 
-                    caught_bug['code'], 
-                    caught_bug['bug_type'], 
-                    caught_bug['severity'],
-                    (int(lineno), int(lineno)), 
-                    self.commit)
-            self.bugs.append(bug)
-            
-            bug_severity = caught_bug['severity']
-            if bug_severity not in self.type_map:
-               self.type_map[bug_severity] = []
-            self.type_map[bug_severity].append(bug)
-
-            fname = caught_bug['file']
-            if fname not in self.file_map:
-                self.file_map[fname] = []
-            self.file_map[fname].append(bug)
+            self._add_bug(self._infer_bug(caught_bug), caught_bug['severity'])
+
+    def _infer_bug(self, caught_bug):
+        lineno = caught_bug['line']
+        return Bug(caught_bug['file'], 
+                caught_bug['qualifier'], 
+                caught_bug['code'], 
+                caught_bug['bug_type'], 
+                caught_bug['severity'],
+                (int(lineno), int(lineno)), 
+                self.commit,
+                notes=caught_bug.get('notes'))
+
+    def infer_reactive(self, prev_br):
+        """
+            Runs Infer in reactive mode on top of the infer-out left by
+            prev_br's run: without a clean, the build only recompiles (and
+            Infer only captures) what changed, and the analysis starts from
+            the files changed since prev_br's commit. Bugs of files that
+            were changed, or that the run reported on, come from this run;
+            all others are carried forward from prev_br.
+
+            A file that depends on a changed one, and whose bug went away
+            because of it, keeps the carried bug until the next full run.
+        """
+        diff = get_backend(".").diff_index(prev_br.commit, self.commit)
+        changed = sorted(fd.new_path for fd in diff.files.values() if fd.status != 'D')
+
+        index = os.path.join(_breezy_dir("--git-dir"), "infer_changed_files.txt")
+        os.makedirs(os.path.dirname(index), exist_ok=True)
+        with open(index, "w") as f:
+            f.write("".join(path + "\n" for path in changed))
+
+        # infer <subcommand> [options] -- <build>
+        command = self.command.split()
+        at = 2 if len(command) > 1 and command[1] in ("run", "capture", "analyze") else 1
+        command = command[:at] + ["--reactive", "--changed-files-index", os.path.abspath(index)] + command[at:]
+        print("...Running Infer reactively on {} changed files...".format(len(changed)))
+        subprocess.run(command)
+        _mark_build_dir(INFER_OUT_DIR, self.commit)
+
+        list_of_bugs = list(format_infer.format(self.dir))
+        recheck = set(changed) | set(caught_bug['file'] for caught_bug in list_of_bugs)
+        carried = self._carry_forward(prev_br, diff, recheck, type_key="severity")
+        print("...Carried {} bugs forward from {}, {} bugs found in changed files...".format(
+            len(self.bugs), prev_br.commit[:5], len(list_of_bugs)))
+        for caught_bug in list_of_bugs:
+            bug = self._infer_bug(caught_bug)
+            if (bug.fingerprint, bug.locs) not in carried:
+                self._add_bug(bug, caught_bug['severity'])
 
     def clang_firefox(self):
         #command to build browser subrepo == ./mach build browser
@@ -146,49 +499,130 @@ class BugReport:
         f.write('mk_add_options MOZ_OBJDIR=@TOPSRCDIR@/obj-ff-dbg\nmk_add_options MOZ_BUILD_PROJECTS="browser"\nmk_add_options AUTOCLOBBER=1\nac_add_options --disable-optimize --enable-debug')
         f.close()
 
-        subprocess.run("rm -rf obj-ff-dbg/".split())
+        # The object dir can only be reused if it was last built at the
+        # commit of the report we carry bugs forward from.
+        incremental = self.prev_br is not None and _build_dir_commit(CLANG_OBJ_DIR) == self.prev_br.commit
+        if not incremental:
+            subprocess.run("rm -rf obj-ff-dbg/".split())
         print("------------------Scanning build------------------")
-        
-        proc = subprocess.Popen(["scan-build","--show-description", "-o", "../breezy/clang_output/"+self.commit] + self.command.split(), stdout=subprocess.PIPE)
-        out, err = proc.communicate()
-        out = str(out).split("\\n")
-        print(out)
-        return
-
-        if "No bugs found." in out[-2] or "No bugs found." in out[-3]:
-            print("No bugs were found. Exiting early.")
-            exit(-1)
-        
-        #directory should be in here
-        # print(out)
-        direct = out[-2].replace("\\", "").split("'")[1].split()[1]
+        if incremental:
+            self.clang_incremental("../breezy/clang_output/"+self.commit, self.prev_br)
+            return
+        self.clang_structured("../breezy/clang_output/"+self.commit)
+
+    def _scan_build(self, output_dir):
+        """
+            Runs the build under scan-build and reads the bugs of the run in
+            self.clang_format.
+
+            return: list of bug dictionaries, as format_clang returns them
+        """
+        start = time.time()
+        if self.clang_format == "html":
+            flags = ["--show-description"]
+        else:
+            flags = ["-" + self.clang_format]
+        subprocess.run(["scan-build"] + flags + ["-o", output_dir] + self.command.split())
+
+        # scan-build writes each run to a new timestamped directory, and
+        # removes it again if there were no bugs
+        runs = [os.path.join(output_dir, d) for d in os.listdir(output_dir)] if os.path.isdir(output_dir) else []
+        runs = [d for d in runs if os.path.getmtime(d) >= start - 1]
+        if not runs:
+            print("No bugs were found.")
+            return []
+        direct = max(runs, key=os.path.getmtime)
         print("direct", direct)
-        
-        list_of_bugs = format_clang.format(direct)
+
+        if self.clang_format == "html":
+            # A worktree_pool worker is a daemon and cannot start a pool, and
+            # its siblings already keep the other cores busy.
+            workers = 1 if multiprocessing.current_process().daemon else os.cpu_count()
+            return format_clang.format(direct, workers=workers, debug=False)
+        formatter = {"plist": format_plist, "sarif": format_sarif}[self.clang_format]
+        return formatter.format(direct, root=os.getcwd())
+
+    def _clang_bug(self, caught_bug):
+        lineno = caught_bug['line']
+        return Bug(caught_bug['file'], 
+                caught_bug['desc'], 
+                caught_bug['code'], 
+                caught_bug['group'], 
+                caught_bug['type'],
+                (int(lineno), int(lineno)), 
+                self.commit,
+                notes=caught_bug.get('notes'))
+
+    def clang_structured(self, output_dir):
+        """
+            Runs scan-build on a clean object dir and reads its output in
+            self.clang_format into bugs. With -plist or -sarif the HTML
+            rendering and parsing are skipped. The object dir is only marked
+            as built at this commit once its bugs are read, since
+            clang_incremental carries the bugs of this report forward.
+        """
+        list_of_bugs = self._scan_build(output_dir)
         print("Number of bugs found: ", len(list_of_bugs))
         for caught_bug in list_of_bugs:
-            lineno = caught_bug['line']
-            bug = Bug(caught_bug['file'], 
-                    caught_bug['desc'], 
-                    caught_bug['code'], 
-                    caught_bug['group'], 
-                    caught_bug['type'],
-                    (int(lineno), int(lineno)), 
-                    self.commit)
-            self.bugs.append(bug)
-            
-            if caught_bug['group'] not in self.type_map:
-               self.type_map[caught_bug['group']] = []
-            self.type_map[caught_bug['group']].append(bug)
-
-            fname = caught_bug['file']
-            if fname not in self.file_map:
-                self.file_map[fname] = []
-            self.file_map[fname].append(bug)
+            self._add_bug(self._clang_bug(caught_bug), caught_bug['group'])
+        _mark_build_dir(CLANG_OBJ_DIR, self.commit)
+
+    def clang_incremental(self, output_dir, prev_br):
+        """
+            Rebuilds on top of the object dir left by prev_br's build, so
+            make only recompiles, and scan-build only analyzes, the
+            translation units that changed. Which ones those were is read
+            from the dependency files (.deps/*.pp) the build rewrote: every
+            source and header they list is re-reported by this run. The bugs
+            of all other files are carried forward from prev_br.
+        """
+        start = time.time()
+        list_of_bugs = self._scan_build(output_dir)
+        rebuilt = _rebuilt_files(CLANG_OBJ_DIR, start)
+
+        diff = get_backend(".").diff_index(prev_br.commit, self.commit)
+        carried = self._carry_forward(prev_br, diff, rebuilt)
+        print("...Carried {} bugs forward from {}, {} files were rebuilt, {} bugs found in them...".format(
+            len(self.bugs), prev_br.commit[:5], len(rebuilt), len(list_of_bugs)))
+        for caught_bug in list_of_bugs:
+            bug = self._clang_bug(caught_bug)
+            if (bug.fingerprint, bug.locs) not in carried:
+                self._add_bug(bug, caught_bug['group'])
+        _mark_build_dir(CLANG_OBJ_DIR, self.commit)
+
+    def tu_analysis(self, analyzer):
+        """
+            Runs analyzer ("clang" or "cppcheck") on every translation unit of
+            the compilation database in the current directory (or the object
+            dir), generating it with self.command first if there is none.
+            Findings are cached per TU in self.cache, by default a local cache
+            in the git dir.
+        """
+        # tu_scheduler imports this module for the cppcheck template
+        from utility import tu_scheduler
+
+        compile_commands = [p for p in ("compile_commands.json", os.path.join(CLANG_OBJ_DIR, "compile_commands.json"))
+                            if os.path.exists(p)]
+        if not compile_commands:
+            subprocess.run(self.command.split())
+            compile_commands = [p for p in ("compile_commands.json", os.path.join(CLANG_OBJ_DIR, "compile_commands.json"))
+                                if os.path.exists(p)]
+        if not compile_commands:
+            print("Error: {} did not generate a compile_commands.json".format(self.command))
+            return
+
+        cache = self.cache
+        if cache is None:
+            # Shared by all worktrees of the repository
+            cache = result_cache.LocalCache(os.path.join(_breezy_dir("--git-common-dir"), "tu_cache"))
+        findings = tu_scheduler.analyze(compile_commands[0], analyzer, os.getcwd(), cache)
+        for fname, desc, code, bug_type, severity, line_no in findings:
+            self._add_bug(Bug(fname, desc, code, bug_type, severity, (line_no, line_no), self.commit), bug_type)
 
     def get_bugs(self):
         # Instantiate bug report from file if it exists
-        if self.save_dir is not None and self.br_file in os.listdir(self.save_dir):
+        saved = self.saved_file() if self.save_dir is not None else None
+        if saved is not None:
             # path = os.path.join(self.save_dir, self.br_file)
             # with open(path, "rb") as f:
             #     d = pickle.load(f)
@@ -196,42 +630,144 @@ class BugReport:
             #         setattr(self, attr, d[attr])
             # print("Loaded bug report from {}".format(self.br_file))
 
-            self.load()
+            self.load(saved)
+            self.prev_br = None
             return 
 
+        key = self.cache_key() if self.cache is not None else None
+        if key is not None and self._load_cached(key):
+            if self.save_dir is not None:
+                self.save()
+            return
+
         run_dir = self.fname if self.fname is not None else "."
         print("Running bug checker on commit {}, {}...".format(self.commit[:5], run_dir))
-        if self.tool == "cppcheck":
+        if self.tool == "cppcheck" and self.prev_br is not None and self.prev_br.fname == self.fname:
+            self.cppcheck_incremental(run_dir, self.prev_br)
+        elif self.tool == "cppcheck":
             self.cppcheck(run_dir)
         elif self.tool == "infer":
             self.infer()
         elif self.tool == "clang_firefox":
             self.clang_firefox()
+        elif self.tool in ("clang_tu", "cppcheck_tu"):
+            self.tu_analysis(self.tool[:-len("_tu")])
         else:
             assert False
+        self.prev_br = None
 
         # Save the bug report to a file since it hasn't been saved before.
         if self.save_dir is not None:
             self.save()
+        if key is not None:
+            self._store_cached(key)
 
-    def load(self):
-        # try:
-        #     print(self.br_file)
-        #     path = os.path.join(self.save_dir, self.br_file)
-        #     with open(path, "rb") as f:
-        #         br_str = pickle.load(f)
-        #         print(br_str)
-        #     print("Loaded bug report from {}".format(self.br_file))
-        # except Exception as e:
-        #     print('load exception thrown')
-        #     print(e)
-
-        path = os.path.join(self.save_dir, self.br_txtfile)
-        with open(path, "r") as f:
-            br_str = f.read()
-            self._load_parser(br_str)
-        f.close()
-        print("Loaded bug report from {}".format(self.br_txtfile))
+    def cache_key(self):
+        """
+            The result of a tool depends on the tree it analyzes rather than on
+            the commit, so reports are cached by the commit's tree together
+            with the tool, its version and its options.
+
+            return: the result_cache key of this report, or None if the
+                    commit is not in the repository
+        """
+        result = subprocess.run(["git", "rev-parse", self.commit + "^{tree}"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return None
+        tree = result.stdout.decode("utf-8").strip()
+        version = result_cache.tool_version(TOOL_EXECUTABLES.get(self.tool, self.tool))
+        return result_cache.cache_key("report", self.tool, version, self.command, self.clean,
+            self.fname, self.clang_format, tree)
+
+    def _load_cached(self, key):
+        path = self.cache.get(key)
+        if path is None:
+            return False
+        own = {attr: getattr(self, attr) for attr in report_store.META_FIELDS}
+        try:
+            self._load_columnar(path)
+        except (OSError, report_store.ReportFormatError):
+            self.bugs, self.type_map, self.file_map = [], {}, {}
+            return False
+        # The cached report may be of another commit with the same tree.
+        for attr, value in own.items():
+            setattr(self, attr, value)
+        commit = sys.intern(str(self.commit))
+        for bug in self.bugs:
+            bug.commit = commit
+        self.prev_br = None
+        print("Loaded bug report for {} from the cache".format(self.commit[:5]))
+        return True
+
+    def _store_cached(self, key):
+        if self.save_dir is not None:
+            self.cache.put(key, os.path.join(self.save_dir, self.br_colfile))
+            return
+        fd, tmp = tempfile.mkstemp(suffix=".brc")
+        os.close(fd)
+        try:
+            report_store.write_report(self, tmp)
+            self.cache.put(key, tmp)
+        finally:
+            os.remove(tmp)
+
+    def saved_file(self):
+        """
+            Returns the name of the file this report was saved to in save_dir,
+            preferring the columnar format over the legacy repr()/pickle files.
+            The save dir's manifest is used rather than a listdir. A report
+            saved under a 5 character prefix only counts if the commit it
+            stores is this one.
+        """
+        entry = get_manifest(self.save_dir).lookup(self.commit)
+        if entry is None:
+            return None
+        if entry['sha'] != self.commit and stored_commit(self.save_dir, entry['file']) != self.commit:
+            return None
+        return entry['file']
+
+    def load(self, name=None):
+        if name is None:
+            name = self.saved_file()
+        path = os.path.join(self.save_dir, name)
+        if name.endswith(".brc"):
+            self._load_columnar(path)
+        elif name.endswith(".txt"):
+            with open(path, "r") as f:
+                self._load_parser(f.read())
+        else:
+            self._load_pickle(path)
+        print("Loaded bug report from {}".format(name))
+
+    def _load_columnar(self, path):
+        meta, columns = report_store.read_report(path)
+        for attr in report_store.META_FIELDS:
+            setattr(self, attr, meta[attr])
+
+        for i in range(meta["nbugs"]):
+            bug = Bug(
+                columns['fname'][i],
+                columns['desc'][i],
+                columns['code'][i],
+                columns['bug_type'][i],
+                columns['severity'][i],
+                columns['locs'][i],
+                columns['commit'][i],
+                columns['fingerprint'][i],
+                columns['notes'][i])
+            self._add_bug(bug, bug.bug_type)
+
+    def _load_pickle(self, path):
+        """
+            Loads the legacy pickled self.__dict__ format.
+        """
+        with open(path, "rb") as f:
+            d = _LegacyUnpickler(f).load()
+        for attr in report_store.META_FIELDS:
+            setattr(self, attr, d[attr])
+        for bug in d['bugs']:
+            self._add_bug(bug, bug.bug_type)
 
     def _load_parser(self, input):
         output = ast.literal_eval(input)
@@ -245,9 +781,7 @@ class BugReport:
         self.br_file = output['br_file']
         self.br_txtfile = output['br_txtfile']
 
-        serialized_bug_list = output['bugs']
-        deserialized_bug_list = self.bugs
-        for serialized_bug in serialized_bug_list:
+        for serialized_bug in output['bugs']:
             deserialized_bug = Bug(
                 serialized_bug['fname'], 
                 serialized_bug['desc'], 
@@ -255,38 +789,149 @@ class BugReport:
                 serialized_bug['bug_type'], 
                 serialized_bug['severity'], 
                 serialized_bug['locs'], 
-                serialized_bug['commit'])
+                serialized_bug['commit'],
+                notes=serialized_bug.get('notes'))
+            self._add_bug(deserialized_bug, serialized_bug['bug_type'])
 
-            deserialized_bug_list.append(deserialized_bug)
+    def save(self):
+        path = os.path.join(self.save_dir, self.br_colfile)
+        report_store.write_report(self, path)
+        get_manifest(self.save_dir).add(self.commit, self.br_colfile, self.tool, len(self.bugs))
+        print("Saved bug report to {}".format(self.br_colfile))
 
-            bug_type = serialized_bug['bug_type']
-            fname = serialized_bug['fname']
+class _LazyFileMap(Mapping):
+    """
+        file_map of a LazyBugReport. Looking up a file materializes the bugs
+        of that file only; membership tests and iteration only touch the index.
+    """
+    def __init__(self, br):
+        self.br = br
+        self.loaded = {}
 
-            if bug_type not in self.type_map:
-                self.type_map[bug_type] = []
-            self.type_map[bug_type].append(deserialized_bug)
+    def __getitem__(self, fname):
+        bugs = self.loaded.get(fname)
+        if bugs is None:
+            code = self.br._fname_codes[fname]
+            bugs = [self.br._bug_at(row) for row in self.br._mapped.rows_for(code)]
+            self.loaded[fname] = bugs
+        return bugs
 
-            if fname not in self.file_map:
-                self.file_map[fname] = []
-            self.file_map[fname].append(deserialized_bug)
+    def __contains__(self, fname):
+        return fname in self.br._fname_codes
 
-    def save(self):
-        # IPython.embed()
-        # try:
-        #     path = os.path.join(self.save_dir, self.br_file)
-        #     print(path)
-        #     with open(path, "wb") as f:
-        #         pickle.dump((repr(self), f))
-        #     print("Saved bug report to {}".format(self.br_file))
-        #     f.close()
-        #     return
-        # except Exception as e:
-        #     print('save exception thrown')
-        #     print(e)
-
-        path = os.path.join(self.save_dir, self.br_txtfile)
-        with open(path, "w") as f:
-            f.write(repr(self))
-        f.close()
-        print("Saved bug report to {}".format(self.br_txtfile))
-        
+    def __iter__(self):
+        return iter(self.br._fname_codes)
+
+    def __len__(self):
+        return len(self.br._fname_codes)
+
+class LazyBugReport(BugReport):
+    """
+        A BugReport backed by a memory-mapped columnar report. file_map builds
+        the bugs of a file the first time the file is looked up, and bugs and
+        type_map materialize the whole report the first time they are used.
+        Reports that are not saved in the columnar format are loaded eagerly.
+    """
+    def __init__(self, commit, dir, save_dir, **kwargs):
+        self._mapped = None
+        kwargs['compile_bugs'] = True
+        BugReport.__init__(self, commit, dir, save_dir=save_dir, **kwargs)
+
+        saved = self.saved_file() if self.save_dir is not None else None
+        if saved is None or not saved.endswith(".brc"):
+            self.get_bugs()
+            return
+
+        self._mapped = report_store.MappedReport(os.path.join(self.save_dir, saved))
+        for attr in report_store.META_FIELDS:
+            setattr(self, attr, self._mapped.meta[attr])
+        self._fname_codes = self._mapped.fnames()
+        self._row_bugs = {}
+        self._materialized = False
+        self.file_map = _LazyFileMap(self)
+        print("Mapped bug report from {}".format(saved))
+
+    @property
+    def bugs(self):
+        if self._mapped is not None and not self._materialized:
+            self.materialize()
+        return self._bugs
+
+    @bugs.setter
+    def bugs(self, value):
+        self._bugs = value
+
+    @property
+    def type_map(self):
+        if self._mapped is not None and not self._materialized:
+            self.materialize()
+        return self._type_map
+
+    @type_map.setter
+    def type_map(self, value):
+        self._type_map = value
+
+    def _bug_at(self, row):
+        bug = self._row_bugs.get(row)
+        if bug is None:
+            m = self._mapped
+            bug = Bug(
+                m.value('fname', row),
+                m.value('desc', row),
+                m.value('code', row),
+                m.value('bug_type', row),
+                m.value('severity', row),
+                m.locs(row),
+                m.value('commit', row),
+                m.fingerprint(row),
+                m.notes(row))
+            self._row_bugs[row] = bug
+        return bug
+
+    def materialize(self):
+        """
+            Builds every bug of the report, reusing the ones that were already
+            built through file_map, and fills bugs and type_map in saved order.
+        """
+        self._materialized = True
+        for row in range(self._mapped.nbugs):
+            bug = self._bug_at(row)
+            self._bugs.append(bug)
+            if bug.bug_type not in self._type_map:
+                self._type_map[bug.bug_type] = []
+            self._type_map[bug.bug_type].append(bug)
+
+        file_map = {}
+        for fname in self.file_map:
+            file_map[fname] = self.file_map[fname]
+        self.file_map = file_map
+
+    def fingerprints(self, fname):
+        m = self._mapped
+        if m is None or self._materialized or not m.has_fingerprints or fname in self.file_map.loaded:
+            return BugReport.fingerprints(self, fname)
+        if fname not in self._fname_codes:
+            return []
+        return [m.fingerprint(row) for row in m.rows_for(self._fname_codes[fname])]
+
+    def bugs_at(self, fname, positions):
+        m = self._mapped
+        if m is None or self._materialized or fname in self.file_map.loaded or fname not in self._fname_codes:
+            return BugReport.bugs_at(self, fname, positions)
+        # Only the requested rows are built, not the whole file
+        rows = m.rows_for(self._fname_codes[fname])
+        return [self._bug_at(rows[k]) for k in positions]
+
+    def num_bugs(self):
+        if self._mapped is not None and not self._materialized:
+            return self._mapped.nbugs
+        return len(self._bugs)
+
+    def close(self):
+        """
+            Releases the mapped file. Bugs that were not materialized before
+            closing can no longer be looked up.
+        """
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
@@ -0,0 +1,200 @@
+"""
+    On-disk index of the first-parent history of a branch.
+
+    The index is built from one "git log -z --first-parent" stream (the same
+    walk as git rev-list --first-parent, but with NUL separated records) and
+    cached under the repository's git directory. Commits are stored oldest
+    first as fixed size records, so when the branch moves forward only the
+    new commits are appended:
+
+        header:  magic (4s) | version (H) | reserved (H) | count (Q) | head (20s)
+        records: sha (20s) | first parent (20s) | commit time (q) | message offset (Q) | message length (I)
+
+    Commit messages live in a separate file that records point into.
+"""
+import os
+import re
+import struct
+import subprocess
+from array import array
+
+MAGIC = b"BRZI"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHQ20s")
+RECORD = struct.Struct("<20s20sqQI")
+NO_PARENT = b"\0" * 20
+
+LOG_FORMAT = "--format=%H%x1f%P%x1f%ct%x1f%B"
+READ_SIZE = 1 << 20
+
+
+def _git(path, *args):
+    result = subprocess.run(["git"] + list(args), stdout=subprocess.PIPE, cwd=path, check=True)
+    return result.stdout.decode("utf-8").strip()
+
+
+def _log_records(path, rev_range):
+    """
+        Streams (sha, first parent, commit time, message) for the first-parent
+        history of rev_range, newest first.
+    """
+    proc = subprocess.Popen(["git", "log", "-z", "--first-parent", LOG_FORMAT, rev_range],
+        stdout=subprocess.PIPE, cwd=path)
+    try:
+        rest = b""
+        while True:
+            chunk = proc.stdout.read(READ_SIZE)
+            if not chunk:
+                break
+            records = (rest + chunk).split(b"\0")
+            rest = records.pop()
+            for record in records:
+                yield _parse_record(record)
+        if rest:
+            yield _parse_record(rest)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def _parse_record(record):
+    sha, parents, timestamp, message = record.split(b"\x1f", 3)
+    parents = parents.split()
+    parent = bytes.fromhex(parents[0].decode("ascii")) if parents else NO_PARENT
+    return bytes.fromhex(sha.decode("ascii")), parent, int(timestamp), message
+
+
+class CommitIndex:
+    """
+        The first-parent commits of rev, oldest first.
+
+        shas: list of full commit hashes, shas[0] is the root commit and
+              shas[-1] the head of rev
+        timestamps: array of commit times (seconds since the epoch)
+        parents: list of first parent hashes (None for the root)
+    """
+    def __init__(self, path=".", rev="HEAD", cache_dir=None):
+        self.path = os.path.abspath(path)
+        self.rev = rev
+        if cache_dir is None:
+            cache_dir = os.path.join(self.path, _git(self.path, "rev-parse", "--git-common-dir"), "breezy")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", rev)
+        self.index_file = os.path.join(cache_dir, "commit_index_{}.bin".format(name))
+        self.message_file = os.path.join(cache_dir, "commit_index_{}.msg".format(name))
+
+        self.head = _git(self.path, "rev-parse", rev + "^{commit}")
+        self._positions = None
+        self._load()
+
+    def __len__(self):
+        return len(self.shas)
+
+    def _read(self):
+        """
+            return: (head sha, list of records) of the cached index, or
+                    (None, []) if there is no usable cache
+        """
+        if not os.path.exists(self.index_file) or not os.path.exists(self.message_file):
+            return None, []
+        with open(self.index_file, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None, []
+            magic, version, _, count, head = HEADER.unpack(header)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None, []
+            data = f.read(count * RECORD.size)
+        if len(data) < count * RECORD.size:
+            return None, []
+        return head.hex(), list(RECORD.iter_unpack(data))
+
+    def _load(self):
+        cached_head, records = self._read()
+
+        if cached_head != self.head:
+            new = []
+            if cached_head is not None:
+                new = list(_log_records(self.path, "{}..{}".format(cached_head, self.head)))
+            if new and new[-1][1] == bytes.fromhex(cached_head):
+                print("...Appending {} commits to the commit index...".format(len(new)))
+                records = self._append(records, new[::-1])
+            else:
+                print("...Building the commit index for {}...".format(self.rev))
+                records = self._rebuild(_log_records(self.path, self.head))
+
+        self.shas = [r[0].hex() for r in records]
+        self.parents = [r[1].hex() if r[1] != NO_PARENT else None for r in records]
+        self.timestamps = array("q", [r[2] for r in records])
+        self._messages = [(r[3], r[4]) for r in records]
+
+    def _rebuild(self, newest_first):
+        commits = list(newest_first)
+        commits.reverse()
+        records = []
+        # Per process, so tools rebuilding at the same time do not write to
+        # each other's temporary files
+        tmp_index = "{}.tmp{}".format(self.index_file, os.getpid())
+        tmp_messages = "{}.tmp{}".format(self.message_file, os.getpid())
+        with open(tmp_messages, "wb") as msgs, open(tmp_index, "wb") as idx:
+            idx.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(commits), bytes.fromhex(self.head)))
+            offset = 0
+            for sha, parent, timestamp, message in commits:
+                msgs.write(message)
+                record = (sha, parent, timestamp, offset, len(message))
+                idx.write(RECORD.pack(*record))
+                records.append(record)
+                offset += len(message)
+        os.replace(tmp_messages, self.message_file)
+        os.replace(tmp_index, self.index_file)
+        return records
+
+    def _append(self, records, oldest_first):
+        """
+            Appends commits to the cached index. The header is rewritten last,
+            so an interrupted append leaves the previous index intact.
+        """
+        with open(self.message_file, "ab") as msgs:
+            offset = msgs.tell()
+            new_records = []
+            for sha, parent, timestamp, message in oldest_first:
+                msgs.write(message)
+                new_records.append((sha, parent, timestamp, offset, len(message)))
+                offset += len(message)
+
+        records = records + new_records
+        with open(self.index_file, "r+b") as idx:
+            idx.seek(HEADER.size + (len(records) - len(new_records)) * RECORD.size)
+            for record in new_records:
+                idx.write(RECORD.pack(*record))
+            idx.truncate()
+            idx.flush()
+            os.fsync(idx.fileno())
+            idx.seek(0)
+            idx.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(records), bytes.fromhex(self.head)))
+        return records
+
+    def position(self, sha):
+        """
+            return: the index of sha in shas, or None if it is not a
+                    first-parent commit of rev
+        """
+        if self._positions is None:
+            self._positions = {s: i for i, s in enumerate(self.shas)}
+        return self._positions.get(sha)
+
+    def message(self, i):
+        offset, length = self._messages[i]
+        with open(self.message_file, "rb") as f:
+            f.seek(offset)
+            return f.read(length).decode("utf-8", "replace")
+
+    def messages(self):
+        """
+            return: every commit message, oldest first, read in one pass
+        """
+        with open(self.message_file, "rb") as f:
+            data = f.read()
+        return [data[o:o + n].decode("utf-8", "replace") for o, n in self._messages]
@@ -2,19 +2,13 @@ from git import Repo
 import os
 import format_clang
 from bug_report import Bug, BugReport
-import sys
-sys.setrecursionlimit(100000)
+from commit_index import CommitIndex
 
 
 def get_repo_commits(repo):
     print("...getting commits...")
-    commits = [repo.head.commit.hexsha]
-    for i, c in enumerate(repo.head.commit.iter_parents()):
-        commits.append(c.hexsha)
-
-    #get set of commits in reverse order
-    commits.reverse()
-    return commits
+    #first-parent commits, oldest first
+    return CommitIndex(repo.working_dir, repo.active_branch.name).shas
 
 if __name__ == '__main__':
     os.chdir("../../gecko-dev")
@@ -24,7 +18,7 @@ if __name__ == '__main__':
     commits = get_repo_commits(repo)
     os.chdir("../breezy")
 
-    commits = commits[650000:]
+    commits = set(commits[650000:])
 
     for commit_hash in os.listdir("clang_output"):
         if "2020" in commit_hash or commit_hash not in commits:
@@ -38,7 +32,8 @@ if __name__ == '__main__':
             print("not in commits:", commit_hash)
             continue
         br = BugReport(commit_hash, tool="clang_firefox", save_dir="clang_save", command=None, clean=None, dir="gecko-dev", compile_bugs=True)
-        list_of_bugs = format_clang.format("clang_output/"+commit_hash+"/"+os.listdir("clang_output/"+commit_hash)[0])
+        list_of_bugs = format_clang.format("clang_output/"+commit_hash+"/"+os.listdir("clang_output/"+commit_hash)[0],
+            workers=os.cpu_count(), debug=False)
         print("Number of bugs found: ", len(list_of_bugs))
         for caught_bug in list_of_bugs:
             lineno = caught_bug['line']
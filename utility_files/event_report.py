@@ -1,40 +1,214 @@
+"""
+    The lifecycle of tracked bugs, one row per bug of bug_list in numpy
+    columns:
+
+        birth      depth of the snapshot the bug was first tracked at
+        resolved   depth it was resolved at, -1 while it is not
+        last_seen  depth of the last snapshot it was still present in
+        touches    number of hunks that changed it
+        lost       whether its file went away without it being resolved
+
+    Depths are the positions of commits that the trackers and
+    resolved_vec have always used. Columns grow by doubling, so adding
+    bugs is amortized O(1) per bug, and queries over them are vectorized.
+"""
+import numpy as np
+from utility import report_store
+from utility.bug_report import Bug
+
+COLUMNS = (("birth", np.int64, -1), ("resolved", np.int64, -1), ("last_seen", np.int64, -1),
+           ("touches", np.int32, 0), ("lost", np.bool_, False))
+MIN_CAPACITY = 64
+
+
 class EventsReport:
     """
         An EventsReport is supplementary to a BugReport and logs how bugs
         and their files have changed over time.
+
+        depth: the depth of the snapshot bug_list was taken at
     """
-    def __init__(self, bug_list, debug=True):
+    def __init__(self, bug_list, debug=True, depth=-1):
         self.bug_list = bug_list
         self.debug = debug
-        self.resolved_vec = [-1 for _ in self.bug_list]
-        self.block_changed = [[] for _ in self.bug_list] 
-    
+        self.n = 0
+        self.columns = {name: np.full(MIN_CAPACITY, fill, dtype=dtype) for name, dtype, fill in COLUMNS}
+        self._types = None
+        self._grow(len(bug_list), depth)
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self, count, depth):
+        capacity = len(self.columns["birth"])
+        if self.n + count > capacity:
+            capacity = max(2 * capacity, self.n + count)
+            for name, dtype, fill in COLUMNS:
+                column = np.full(capacity, fill, dtype=dtype)
+                column[:self.n] = self.columns[name][:self.n]
+                self.columns[name] = column
+        self.columns["birth"][self.n:self.n + count] = depth
+        self.columns["last_seen"][self.n:self.n + count] = depth
+        self.n += count
+
+    def column(self, name):
+        """
+            return: view of the column name over the bugs of bug_list
+        """
+        return self.columns[name][:self.n]
+
+    @property
+    def resolved_vec(self):
+        return self.column("resolved")
+
+    @resolved_vec.setter
+    def resolved_vec(self, values):
+        self.columns["resolved"][:self.n] = values
+
+    def add_bugs(self, bugs, depth):
+        """
+            Starts tracking bugs first seen at depth.
+        """
+        self.bug_list += bugs
+        self._grow(len(bugs), depth)
+
     def update_resolved(self, idx, depth, resolved):
         if self.debug: print("Bug #{}:".format(idx + 1))
         if self.debug: print("M: {}".format(self.bug_list[idx].fname))
 
-        self.block_changed.append(depth)
+        self.columns["touches"][idx] += 1
         if resolved:
             if self.debug: print("Bug fixed!")
-            self.resolved_vec[idx] = depth
+            self.columns["resolved"][idx] = depth
         else:
             if self.debug: print("Bug block changed, but not resolved")
         if self.debug: print("-----------")
 
+    def update_lost(self, ids):
+        """
+            Marks bugs whose file was deleted as lost.
+        """
+        self.columns["lost"][np.asarray(ids, dtype=np.int64)] = True
+
+    def seen(self, depth):
+        """
+            Records that every live bug was still present at depth.
+        """
+        live = self.live()
+        self.column("last_seen")[live] = depth
+
+    def live(self):
+        """
+            return: mask of the bugs neither resolved nor lost
+        """
+        return (self.column("resolved") == -1) & ~self.column("lost")
+
+    def state(self):
+        """
+            return: dictionary from column name to a copy of its rows
+        """
+        return {name: self.column(name).copy() for name, _, _ in COLUMNS}
+
+    def set_state(self, state):
+        for name, _, _ in COLUMNS:
+            self.column(name)[:] = state[name]
+
+    def __getstate__(self):
+        return {'bug_list': self.bug_list, 'debug': self.debug, 'columns': self.state()}
+
+    def __setstate__(self, state):
+        EventsReport.__init__(self, state['bug_list'], state.get('debug', True))
+        if 'columns' in state:
+            self.set_state(state['columns'])
+        else:
+            # Pickled before the columns: only resolved_vec was kept per bug.
+            self.resolved_vec = state['resolved_vec']
+
+    def _type_codes(self, attr):
+        """
+            return: (distinct values of attr, code of every bug's value)
+        """
+        if self._types is None or self._types[0] != attr or len(self._types[2]) != self.n:
+            distinct, codes = report_store.dictionary_encode(getattr(bug, attr) for bug in self.bug_list)
+            self._types = (attr, distinct, np.frombuffer(codes, dtype=np.uint32) if self.n else np.zeros(0, dtype=np.uint32))
+        return self._types[1], self._types[2]
+
+    def resolved_by(self, attr="bug_type"):
+        """
+            return: dictionary from each value of attr to its number of
+                    resolved bugs
+        """
+        distinct, codes = self._type_codes(attr)
+        counts = np.bincount(codes[self.column("resolved") >= 0], minlength=len(distinct))
+        return {distinct[i]: int(c) for i, c in enumerate(counts) if c}
+
+    def lifetimes(self):
+        """
+            return: number of snapshot depths between the birth and the
+                    resolution of every bug, -1 for unresolved bugs
+        """
+        resolved = self.column("resolved")
+        return np.where(resolved >= 0, np.abs(resolved - self.column("birth")), -1)
+
+    def median_lifetime_by(self, attr="severity"):
+        """
+            return: dictionary from each value of attr to the median lifetime
+                    of its resolved bugs
+        """
+        distinct, codes = self._type_codes(attr)
+        lifetimes = self.lifetimes()
+        resolved = lifetimes >= 0
+        codes, lifetimes = codes[resolved], lifetimes[resolved]
+        order = np.argsort(codes, kind='stable')
+        codes, lifetimes = codes[order], lifetimes[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        return {distinct[group[0]]: float(np.median(l))
+                for group, l in zip(np.split(codes, bounds), np.split(lifetimes, bounds)) if len(group)}
+
     def resolved_distribution(self):
-        resolved_types = {}
-        for i, r in enumerate(self.resolved_vec):
-            if r >= 0:
-                t = self.bug_list[i].bug_type
-                if t not in resolved_types:
-                    resolved_types[t] = 0
-                resolved_types[t] += 1
+        resolved_types = self.resolved_by("bug_type")
         for t in resolved_types:
             print(t, resolved_types[t])
-    
+
     def get_bugs(self):
-        to_return = []
-        for i, r in enumerate(self.resolved_vec):
-            if r >= 0:
-                to_return.append(self.bug_list[i])
-        return to_return
\ No newline at end of file
+        return [self.bug_list[i] for i in np.flatnonzero(self.column("resolved") >= 0)]
+
+    def save(self, path):
+        """
+            Writes the report to path as a compressed .npz: the columns, and
+            the bugs as dictionary encoded string columns like the columnar
+            bug reports, their notes included.
+        """
+        arrays = {name: self.column(name) for name, _, _ in COLUMNS}
+        for col in report_store.STRING_COLUMNS:
+            data = report_store.encode_string_column([getattr(bug, col) for bug in self.bug_list])
+            arrays["bug_" + col] = np.frombuffer(data, dtype=np.uint8)
+        arrays["bug_locs"] = np.array([bug.locs for bug in self.bug_list], dtype=np.int64).reshape(-1, 2)
+        arrays["bug_fingerprint"] = np.array([bug.fingerprint for bug in self.bug_list], dtype=np.uint64)
+        notes = report_store.encode_string_column([report_store.encode_notes(bug.notes) for bug in self.bug_list])
+        arrays["bug_notes"] = np.frombuffer(notes, dtype=np.uint8)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path, debug=True):
+        with np.load(path) as data:
+            n = len(data["birth"])
+            columns = {}
+            for col in report_store.STRING_COLUMNS:
+                values, codes = report_store.decode_string_column(data["bug_" + col].tobytes(), n)
+                columns[col] = [values[c] for c in codes]
+            locs = data["bug_locs"].tolist()
+            fingerprints = data["bug_fingerprint"].tolist()
+            # Reports saved before bugs kept their notes have no bug_notes
+            notes = [None] * n
+            if "bug_notes" in data:
+                values, codes = report_store.decode_string_column(data["bug_notes"].tobytes(), n)
+                values = [report_store.decode_notes(v) for v in values]
+                notes = [values[c] for c in codes]
+            bug_list = [Bug(columns["fname"][i], columns["desc"][i], columns["code"][i],
+                            columns["bug_type"][i], columns["severity"][i], locs[i],
+                            columns["commit"][i], fingerprints[i], notes[i]) for i in range(n)]
+            er = cls(bug_list, debug)
+            er.set_state({name: data[name] for name, _, _ in COLUMNS})
+        return er
@@ -1,20 +1,29 @@
 from bs4 import BeautifulSoup, Comment, SoupStrainer
+import bisect
 import codecs
+import math
+import multiprocessing
+import re
+from html import unescape
 
 def parse_index(direct):
+    """
+        Reads every bug of index.html with BeautifulSoup. Only used for the
+        reports that lack the metadata comments bug_from_metadata reads the
+        same columns from.
+    """
     bugs = []
     file = codecs.open(direct+"/index.html", 'r')
 
     soup = BeautifulSoup(file.read(), 'html5lib')
     for row in soup.findAll('table')[2].tbody.findAll('tr'):
         bug = {}
-        bug["group"] = row.findAll('td')[0].contents[0]
-        bug["type"] = row.findAll('td')[1].contents[0]
-        bug["file"] = row.findAll('td')[2].contents[0]
-        bug["function"] = row.findAll('td')[3].contents[0]
-        bug["line"] = row.findAll('td')[4].contents[0]
-        bug["desc"] = row.findAll('td')[6].contents[0]
-        bug["code"] = "ree"
+        bug["group"] = str(row.findAll('td')[0].contents[0])
+        bug["type"] = str(row.findAll('td')[1].contents[0])
+        bug["file"] = str(row.findAll('td')[2].contents[0])
+        bug["function"] = str(row.findAll('td')[3].contents[0])
+        bug["line"] = str(row.findAll('td')[4].contents[0])
+        bug["desc"] = str(row.findAll('td')[6].contents[0])
         bugs.append(bug)
     
     idx = 0
@@ -24,61 +33,200 @@ def parse_index(direct):
             idx += 1
     return bugs
 
-def parse_bug_reports(bugs, direct):
+META_RE = re.compile(r"<!-- (BUG\w+|FILENAME|FUNCTIONNAME) (.*?) -->")
+REPORTBUG_RE = re.compile(r"<!-- REPORTBUG id=\"([^\"]+)\" -->")
+INDEX_FIELDS = ("BUGFILE", "BUGDESC", "BUGTYPE", "BUGCATEGORY", "BUGLINE")
+FILENAME_RE = re.compile(r"<h4[^>]*class=\"?FileName\"?[^>]*>(.*?)</h4>", re.S)
+TABLE_RE = re.compile(r"<table class=\"?code")
+TAG_RE = re.compile(r"<[^>]*>")
+MSG_RE = re.compile(r"class=[\"']?msg")
+
+def read_metadata(html):
+    """
+        Reads the comments scan-build puts at the top of every report
+        (BUGTYPE, BUGFILE, BUGLINE, BUGDESC, ...), which end at BUGMETAEND.
+
+        return: dictionary from comment name to value, or None if the report
+                has no metadata block
+    """
+    end = html.find("<!-- BUGMETAEND -->")
+    if end == -1:
+        return None
+    return {m.group(1): m.group(2) for m in META_RE.finditer(html, 0, end)}
+
+def report_ids(direct):
+    """
+        return: the report file of every bug of index.html, in index order,
+                from the REPORTBUG comment scan-build writes after each row
+    """
+    with codecs.open(direct+"/index.html", 'r') as file:
+        return REPORTBUG_RE.findall(file.read())
+
+def bug_from_metadata(bug, meta):
+    """
+        Fills in the index.html columns of a bug from the metadata comments
+        of its report.
+
+        return: False, leaving bug as it was, if any of the comments is
+                missing or malformed
+    """
+    if meta is None or any(not meta.get(field, "").strip() for field in INDEX_FIELDS) \
+            or not meta["BUGLINE"].strip().isdigit():
+        return False
+    bug["group"] = unescape(meta["BUGCATEGORY"])
+    bug["type"] = unescape(meta["BUGTYPE"])
+    bug["file"] = _display_path(unescape(meta["BUGFILE"]))
+    bug["function"] = unescape(meta.get("FUNCTIONNAME", ""))
+    bug["line"] = meta["BUGLINE"].strip()
+    bug["desc"] = unescape(meta["BUGDESC"])
+    return True
+
+def _display_path(path):
+    return "/".join(path.split("/")[4:])
+
+def _text(fragment):
+    return unescape(TAG_RE.sub(" ", fragment))
+
+def parse_report_fast(bug, html):
+    """
+        Finds the line of code of a bug by jumping straight to the id="LN<line>"
+        anchors of the bug's line, instead of parsing the whole report. The
+        line is the one followed by a message row, as in parse_report_soup.
+
+        return: True if the code was found, False if the report has to be
+                parsed with BeautifulSoup
+    """
+    meta = read_metadata(html)
+    if meta is None or meta.get("BUGLINE") != str(bug['line']).strip():
+        return False
+
+    file_names = [_display_path(_text(m.group(1)).strip()) for m in FILENAME_RE.finditer(html)]
+    tables = [m.start() for m in TABLE_RE.finditer(html)]
+    anchor = 'id="LN{}"'.format(meta["BUGLINE"])
+
+    found = False
+    pos = html.find(anchor)
+    while pos != -1:
+        row_start = html.rfind("<tr", 0, pos)
+        row_end = html.find("</tr>", pos)
+        next_end = html.find("</tr>", row_end + 1)
+        if row_start != -1 and row_end != -1 and next_end != -1 \
+                and MSG_RE.search(html, row_end, next_end):
+            bug['code'] = " ".join(_text(html[row_start:row_end]).split()[1:])
+            table = bisect.bisect_right(tables, pos) - 1
+            if file_names and table >= 0:
+                bug['file'] = file_names[table]
+            found = True
+        pos = html.find(anchor, pos + len(anchor))
+    return found
+
+def parse_report_soup(bug, html):
+    html = str(html.replace("</td></td>", "</td>"))
+    
+    product = SoupStrainer('table',{'class': 'code'})
+    soup = BeautifulSoup(html,'html5lib', parse_only=product)
+    file_names = []
+
+    for fn in soup.findAll('h4', {'class':'FileName'}):
+        file_names.append("/".join(fn.get_text().split("/")[4:]))
+
+    code_blocks = soup.findAll('table', {'class':'code'})
+    for i, f in enumerate(code_blocks):
+        table_rows = f.findAll('tr')
+
+        for row in range(1, len(table_rows)):
+            if 'LN'+bug['line'] in str(table_rows[row-1]) and 'class="msg' in str(table_rows[row]):
+                bug['code'] = " ".join(table_rows[row-1].get_text().split()[1:])
+                if file_names:
+                    bug['file'] = file_names[i]
+
+def parse_bug_reports(bugs, direct, debug=True):
+    """
+        Reads the code of every bug from its report. Bugs that only have a
+        report file are first filled in from the report's metadata; those
+        whose report has none are left without a line for format to fill in
+        from index.html.
+    """
     for bug in bugs:
         report_name = bug['bug_report']
         file = codecs.open(direct+"/"+report_name, 'r')
         try:
             html = file.read()
         except UnicodeDecodeError:
-            print(UnicodeDecodeError)
             bug['code'] = "Could not parse from HTML"
-            print(bug)
+            if debug:
+                print(UnicodeDecodeError)
+                print(bug)
             continue
         except:
-            print("something went wrong")
             bug['code'] = "Could not parse from HTML"
-            print(bug)
+            if debug:
+                print("something went wrong")
+                print(bug)
             continue
         file.close()
-        html = str(html.replace("</td></td>", "</td>"))
-        
-        product = SoupStrainer('table',{'class': 'code'})
-        soup = BeautifulSoup(html,'html5lib', parse_only=product)
-        lines_of_code = ["index0"]
-        file_names = []
 
-        print(bug['bug_report'])
+        if 'line' not in bug and not bug_from_metadata(bug, read_metadata(html)):
+            continue
 
-        for fn in soup.findAll('h4', {'class':'FileName'}):
-            file_names.append("/".join(fn.get_text().split("/")[4:]))
-    
-        code_blocks = soup.findAll('table', {'class':'code'})
-        for i, f in enumerate(code_blocks):
-            table_rows = f.findAll('tr')
+        if debug:
+            print(bug['bug_report'])
 
-            for row in range(1, len(table_rows)):
-                if 'LN'+bug['line'] in str(table_rows[row-1]) and 'class="msg' in str(table_rows[row]):
-                    bug['code'] = " ".join(table_rows[row-1].get_text().split()[1:])
-                    if file_names:
-                        bug['file'] = file_names[i]
+        # Only reports without scan-build's metadata, or whose line could not
+        # be found, pay for a full HTML parse.
+        if not parse_report_fast(bug, html):
+            parse_report_soup(bug, html)
 
         if 'code' not in bug:
-            print(bug['bug_report'])
-            print("**************could not parse from HTML******************")
-            print()
+            if debug:
+                print(bug['bug_report'])
+                print("**************could not parse from HTML******************")
+                print()
             bug['code'] = "Could not parse from HTML"
 
-        print(bug['file'])
-        print(bug['type'])
-        print(bug['code'])
-        print()
+        if debug:
+            print(bug['file'])
+            print(bug['type'])
+            print(bug['code'])
+            print()
 
     return bugs
 
-def format(direct):
-    bugs = parse_index(direct)
-    return parse_bug_reports(bugs, direct)
+def _parse_chunk(args):
+    bugs, direct, debug = args
+    return parse_bug_reports(bugs, direct, debug)
+
+def format(direct, workers=1, debug=True, chunks_per_worker=4):
+    """
+        Parses a scan-build output directory into a list of bug dictionaries,
+        in the order of its index.html.
+
+        workers: number of processes to parse the per-bug reports with. The
+                 reports are independent, so they are split into chunks and
+                 the results put back together in index order.
+        debug: print every bug as it is parsed
+
+        The columns of index.html are read from the metadata comments of each
+        report, so index.html itself is only parsed when a report lacks them.
+    """
+    bugs = [{'bug_report': report} for report in report_ids(direct)]
+    if workers <= 1 or len(bugs) < 2:
+        bugs = parse_bug_reports(bugs, direct, debug)
+    else:
+        size = max(1, math.ceil(len(bugs) / (workers * chunks_per_worker)))
+        chunks = [(bugs[i:i + size], direct, debug) for i in range(0, len(bugs), size)]
+        with multiprocessing.Pool(workers) as pool:
+            parsed = pool.map(_parse_chunk, chunks)
+        bugs = [bug for chunk in parsed for bug in chunk]
+
+    missing = [bug for bug in bugs if 'line' not in bug]
+    if missing:
+        rows = {row['bug_report']: row for row in parse_index(direct)}
+        for bug in missing:
+            bug.update(rows[bug['bug_report']])
+            bug.pop('code', None)
+        parse_bug_reports(missing, direct, debug)
+    return bugs
 
 if __name__ == '__main__':
     output = format('../clang_output/2020-06-11-045140-5136-1')
@@ -1,12 +1,61 @@
 import json
+import os
+from utility.format_plist import source_context, clear_source_cache
+
+READ_SIZE = 1 << 20
+# Lines of source around a bug's line kept as its code, like the excerpts
+# of Infer's bugs.txt
+CONTEXT_BEFORE = 2
+CONTEXT_AFTER = 2
+
+def iter_report(path):
+    """
+        Yields the bugs of an Infer report.json one at a time. The file is
+        a single JSON array, which is decoded one element at a time as it
+        is read, so only the bug being decoded is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        while True:
+            # Skip the array's brackets and commas between elements
+            while pos < len(buf) and buf[pos] in " \t\r\n[,]":
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    return
+                buf, pos = f.read(READ_SIZE), 0
+                eof = not buf
+                continue
+            try:
+                bug, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_SIZE)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            pos = end
+            yield bug
 
 def format(run_dir):
-    f = open(run_dir+"/infer-out/report.json")
-    report = json.load(f)
+    """
+        Yields the bugs Infer found in run_dir. The code of a bug is read
+        from the source around its line, so bugs.txt is no longer needed;
+        bugs reported twice (same Infer hash and key) are yielded once.
+    """
+    clear_source_cache()
+    seen = set()
+    for bug in iter_report(os.path.join(run_dir, "infer-out", "report.json")):
+        ident = (bug.get('hash'), bug.get('key'))
+        if ident != (None, None):
+            if ident in seen:
+                continue
+            seen.add(ident)
 
-    #dict_keys(['bug_type', 'qualifier', 'severity', 'line', 'column', 'procedure', 'procedure_start_line', 'file', 'bug_trace', 'key', 'hash', 'bug_type_hum', 'access'])
-    output_data = []
-    for bug in report:
         new_bug = {}
         new_bug['bug_type'] = bug['bug_type']
         new_bug['severity'] = bug['severity']
@@ -14,31 +63,11 @@ def format(run_dir):
         new_bug['line'] = bug['line']
         new_bug['procedure'] = bug['procedure']
         new_bug['file'] = bug['file']
-        output_dataa = output_data.append(new_bug)
-    f.close()
-
-    f = open(run_dir+"/infer-out/bugs.txt", 'r')
-    lines = f.readlines()
-
-    #split list by new lines
-    size = len(lines)
-    idx_list = [idx for idx, val in enumerate(lines) if val == "\n"]
-    bug_report = [lines[i: j] for i, j in
-            zip([0] + idx_list, idx_list + 
-            ([size] if idx_list[-1] != size else []))] 
-    f.close()
-
-    #remove header and footer
-    bug_report = bug_report[1:len(bug_report)-2]
-    for i, bug_data in enumerate(bug_report):
-        #get only lines that start with a number
-        #remove header == first 5 characters of string
-        data = [d.strip()[6:] for d in bug_data if d.strip() != "" and d.strip()[0].isnumeric()]
-        bug_text = '\n'.join(data)
-
-        #add to output_data
-        output_data[i]['code'] = bug_text
-
-
-    # print(output_data[0])
-    return output_data
\ No newline at end of file
+        new_bug['hash'] = bug.get('hash')
+        new_bug['key'] = bug.get('key')
+        # The trace of events leading to the bug, as (file, line, description)
+        new_bug['notes'] = [(step.get('filename'), step.get('line_number'), step.get('description', ""))
+                            for step in bug.get('bug_trace', [])]
+        new_bug['code'] = source_context(os.path.join(run_dir, bug['file']), bug['line'],
+            CONTEXT_BEFORE, CONTEXT_AFTER)
+        yield new_bug
@@ -0,0 +1,107 @@
+import functools
+import glob
+import os
+import plistlib
+
+@functools.lru_cache(maxsize=64)
+def _read_lines(path, mtime_ns, size):
+    try:
+        with open(path, "r", errors="replace") as f:
+            return f.read().split("\n")
+    except OSError:
+        return None
+
+def _source_lines(path):
+    """
+        return: the lines of path, or None if it cannot be read. The tree is
+                checked out to another commit between analyses, so cached
+                lines are keyed by the file's modification time and size too.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _read_lines(path, st.st_mtime_ns, st.st_size)
+
+def clear_source_cache():
+    """
+        Forgets every source file read so far, called before reading the
+        reports of a new snapshot.
+    """
+    _read_lines.cache_clear()
+
+def source_line(path, line):
+    """
+        return: the line of code at path:line with its whitespace collapsed,
+                like the code column of the HTML reports
+    """
+    lines = _source_lines(path)
+    if lines is None or not 0 < line <= len(lines):
+        return "Could not read from source"
+    return " ".join(lines[line - 1].split())
+
+def source_context(path, line, before, after):
+    """
+        return: the lines of code from line - before to line + after of
+                path, stripped and joined by newlines
+    """
+    lines = _source_lines(path)
+    if lines is None or not 0 < line <= len(lines):
+        return "Could not read from source"
+    return "\n".join(l.strip() for l in lines[max(0, line - 1 - before):line + after] if l.strip())
+
+def relative_path(path, root):
+    """
+        Makes the paths the compiler saw relative to the repository, so they
+        match the file names git reports.
+    """
+    if root is None:
+        return path
+    path = os.path.normpath(os.path.join(root, path))
+    if path.startswith(os.path.abspath(root) + os.sep):
+        return os.path.relpath(path, root)
+    return path
+
+def parse_plist(path, root=None):
+    with open(path, "rb") as f:
+        report = plistlib.load(f)
+    files = report.get('files', [])
+
+    bugs = []
+    for diag in report.get('diagnostics', []):
+        loc = diag['location']
+        fname = os.path.join(root or "", files[loc['file']])
+        bug = {}
+        bug['group'] = diag.get('category', "")
+        bug['type'] = diag.get('type', diag.get('check_name', ""))
+        bug['file'] = relative_path(files[loc['file']], root)
+        bug['function'] = diag.get('issue_context', "")
+        bug['line'] = loc['line']
+        bug['desc'] = diag.get('description', "")
+        bug['code'] = source_line(fname, loc['line'])
+        bug['hash'] = diag.get('issue_hash_content_of_line_in_context', "")
+        # The path of events leading to the bug, as (file, line, message)
+        bug['notes'] = [(relative_path(files[event['location']['file']], root),
+                         event['location']['line'], event.get('message', ""))
+                        for event in diag.get('path', []) if event.get('kind') == 'event']
+        bugs.append(bug)
+    return bugs
+
+def format(direct, root=None):
+    """
+        Reads every .plist file scan-build -plist wrote to direct. A bug in a
+        header is reported by every translation unit including it, so
+        diagnostics are deduplicated by file and clang's issue hash.
+
+        root: repository the build ran in, file names are made relative to it
+    """
+    clear_source_cache()
+    bugs = []
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(direct, "**", "*.plist"), recursive=True)):
+        for bug in parse_plist(path, root):
+            key = (bug['file'], bug['line'], bug['type'], bug['hash'] or bug['desc'])
+            if key not in seen:
+                seen.add(key)
+                bugs.append(bug)
+    return bugs
@@ -0,0 +1,66 @@
+import glob
+import json
+import os
+from urllib.parse import unquote, urlparse
+from utility.format_plist import source_line, relative_path, clear_source_cache
+
+def _path(location):
+    uri = location['physicalLocation']['artifactLocation'].get('uri', "")
+    return unquote(urlparse(uri).path) if uri.startswith("file:") else uri
+
+def _line(location):
+    return location['physicalLocation'].get('region', {}).get('startLine', 0)
+
+def parse_sarif(path, root=None):
+    """
+        clang's SARIF output names each result's checker but not the bug
+        category of the HTML and plist reports, so the checker's package
+        (core, deadcode, unix, ...) is used as the group and the checker as
+        the type.
+    """
+    with open(path, "r") as f:
+        report = json.load(f)
+
+    bugs = []
+    for run in report.get('runs', []):
+        for result in run.get('results', []):
+            if not result.get('locations'):
+                continue
+            loc = result['locations'][0]
+            fname = os.path.join(root or "", _path(loc))
+            rule = result.get('ruleId', "")
+            bug = {}
+            bug['group'] = rule.rsplit(".", 1)[0]
+            bug['type'] = rule
+            bug['file'] = relative_path(_path(loc), root)
+            bug['function'] = ""
+            bug['line'] = _line(loc)
+            bug['desc'] = result.get('message', {}).get('text', "")
+            bug['code'] = source_line(fname, _line(loc))
+            bug['hash'] = "".join(result.get('partialFingerprints', {}).values())
+            bug['notes'] = []
+            for flow in result.get('codeFlows', []):
+                for thread in flow.get('threadFlows', []):
+                    for step in thread.get('locations', []):
+                        event = step.get('location', {})
+                        if 'physicalLocation' in event:
+                            bug['notes'].append((relative_path(_path(event), root), _line(event),
+                                                 event.get('message', {}).get('text', "")))
+            bugs.append(bug)
+    return bugs
+
+def format(direct, root=None):
+    """
+        Reads every .sarif file scan-build -sarif wrote to direct, like
+        format_plist.format.
+    """
+    clear_source_cache()
+    bugs = []
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(direct, "**", "*.sarif"), recursive=True)):
+        for bug in parse_sarif(path, root):
+            key = (bug['file'], bug['line'], bug['type'], bug['hash'] or bug['desc'])
+            if key not in seen:
+                seen.add(key)
+                bugs.append(bug)
+    return bugs
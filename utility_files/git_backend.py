@@ -0,0 +1,307 @@
+"""
+    Pluggable access to git objects. The in-process backends read trees and
+    blobs and compute diffs without forking a git process per query;
+    SubprocessBackend shells out to git. pygit2 is used when it is installed
+    and git otherwise. dulwich computes its own line diffs, which do not
+    match git's, so it is only used when asked for by name.
+
+    Every backend returns diffs as a git_diff.DiffIndex and numstats in the
+    same [insertions, deletions, path] shape as "git diff --numstat".
+"""
+import difflib
+import os
+import subprocess
+from utility import git_diff
+
+DIFF_CACHE_SIZE = 4
+
+
+class GitBackend:
+    name = None
+
+    def __init__(self, path="."):
+        self.path = os.path.abspath(path)
+        self._diff_cache = {}
+
+    def diff_index(self, curr_commit, next_commit):
+        """
+            return: DiffIndex of the zero context, rename detecting diff
+                    between two commits. The last few pairs are cached.
+        """
+        key = (curr_commit, next_commit)
+        if key not in self._diff_cache:
+            if len(self._diff_cache) >= DIFF_CACHE_SIZE:
+                del self._diff_cache[next(iter(self._diff_cache))]
+            self._diff_cache[key] = self._diff_index(curr_commit, next_commit)
+        return self._diff_cache[key]
+
+    def _diff_index(self, curr_commit, next_commit):
+        raise NotImplementedError
+
+    def numstat(self, curr_commit, next_commit):
+        """
+            return: list of [insertions, deletions, path] string lists, with
+                    "-" counts for binary files, like git diff --numstat
+        """
+        raise NotImplementedError
+
+    def shortstat(self, curr_commit, next_commit):
+        """
+            return: the lines git diff --shortstat would print
+        """
+        stats = self.numstat(curr_commit, next_commit)
+        if not stats:
+            return []
+        insertions = sum(int(s[0]) for s in stats if s[0] != "-")
+        deletions = sum(int(s[1]) for s in stats if s[1] != "-")
+
+        line = " {} file{} changed".format(len(stats), "" if len(stats) == 1 else "s")
+        if insertions or not deletions:
+            line += ", {} insertion{}(+)".format(insertions, "" if insertions == 1 else "s")
+        if deletions or not insertions:
+            line += ", {} deletion{}(-)".format(deletions, "" if deletions == 1 else "s")
+        return [line]
+
+    def read_blob(self, commit, path):
+        """
+            return: the bytes of path as of commit
+        """
+        raise NotImplementedError
+
+    def list_tree(self, commit):
+        """
+            return: dictionary from every file path in commit to its blob sha
+        """
+        raise NotImplementedError
+
+
+class SubprocessBackend(GitBackend):
+    name = "subprocess"
+
+    def _git(self, *args):
+        result = subprocess.run(["git", "-c", "core.quotepath=off"] + list(args),
+            stdout=subprocess.PIPE, cwd=self.path, check=True)
+        return result.stdout
+
+    def _diff_index(self, curr_commit, next_commit):
+        return git_diff.diff_index(curr_commit, next_commit, cwd=self.path)
+
+    def numstat(self, curr_commit, next_commit):
+        out = self._git("diff", "--numstat", curr_commit, next_commit)
+        return [x.split("\t") for x in out.decode("utf-8", "surrogateescape").split("\n")[:-1]]
+
+    def shortstat(self, curr_commit, next_commit):
+        out = self._git("diff", curr_commit, next_commit, "--shortstat")
+        return out.decode("utf-8").split("\n")[:-1]
+
+    def read_blob(self, commit, path):
+        return self._git("cat-file", "blob", "{}:{}".format(commit, path))
+
+    def list_tree(self, commit):
+        out = self._git("ls-tree", "-r", "-z", commit)
+        tree = {}
+        for entry in out.split(b"\0"):
+            if not entry:
+                continue
+            info, path = entry.split(b"\t", 1)
+            mode, kind, sha = info.split(b" ")
+            if kind == b"blob":
+                tree[path.decode("utf-8", "surrogateescape")] = sha.decode("ascii")
+        return tree
+
+
+def _count(n):
+    # git leaves the count out of a hunk header when it is 1
+    return None if n == 1 else n
+
+
+class Pygit2Backend(GitBackend):
+    """
+        libgit2 detects renames and counts changed lines like git, but can
+        split an ambiguous change into hunks differently in rare cases.
+    """
+    name = "pygit2"
+
+    def __init__(self, path="."):
+        import pygit2
+        GitBackend.__init__(self, path)
+        self.pygit2 = pygit2
+        self.repo = pygit2.Repository(self.path)
+
+    def _tree(self, commit):
+        return self.repo.revparse_single(commit).peel(self.pygit2.Tree)
+
+    def _diff(self, curr_commit, next_commit, context_lines=0):
+        # Pinned to what git_diff.DIFF_ARGS asks of git: libgit2 leaves the
+        # indent heuristic off and reads rename detection from the config.
+        pygit2 = self.pygit2
+        diff = self.repo.diff(curr_commit, next_commit, flags=pygit2.GIT_DIFF_INDENT_HEURISTIC,
+                              context_lines=context_lines, interhunk_lines=0)
+        diff.find_similar(flags=pygit2.GIT_DIFF_FIND_RENAMES,
+                          rename_threshold=git_diff.RENAME_THRESHOLD,
+                          rename_limit=git_diff.RENAME_LIMIT)
+        return diff
+
+    def _diff_index(self, curr_commit, next_commit):
+        index = git_diff.DiffIndex(curr_commit, next_commit)
+        for patch in self._diff(curr_commit, next_commit):
+            delta = patch.delta
+            fd = git_diff.FileDiff(delta.old_file.path, delta.new_file.path)
+            status = delta.status_char()
+            fd.status = status if status in "ADR" else "M"
+            for hunk in patch.hunks:
+                fd.add_hunk(hunk.old_start, _count(hunk.old_lines),
+                            hunk.new_start, _count(hunk.new_lines))
+            index.files[fd.old_path] = fd
+        return index
+
+    def numstat(self, curr_commit, next_commit):
+        stats = []
+        for patch in self._diff(curr_commit, next_commit):
+            delta = patch.delta
+            path = delta.new_file.path
+            if delta.status_char() == "R":
+                path = "{} => {}".format(delta.old_file.path, delta.new_file.path)
+            if delta.is_binary:
+                stats.append(["-", "-", path])
+            else:
+                _, additions, deletions = patch.line_stats
+                stats.append([str(additions), str(deletions), path])
+        return stats
+
+    def read_blob(self, commit, path):
+        return self._tree(commit)[path].data
+
+    def list_tree(self, commit):
+        tree = {}
+        stack = [("", self._tree(commit))]
+        while stack:
+            prefix, t = stack.pop()
+            for entry in t:
+                if entry.type_str == "tree":
+                    stack.append((prefix + entry.name + "/", self.repo[entry.id]))
+                elif entry.type_str == "blob":
+                    tree[prefix + entry.name] = str(entry.id)
+        return tree
+
+
+class DulwichBackend(GitBackend):
+    """
+        dulwich has no line diff of its own, so hunks are computed with
+        difflib. They often differ from git's, and so do the insertion and
+        deletion counts of numstat and shortstat, so file_statistics output
+        changes with this backend. get_backend never picks it by default.
+    """
+    name = "dulwich"
+
+    def __init__(self, path="."):
+        from dulwich.repo import Repo
+        GitBackend.__init__(self, path)
+        self.repo = Repo(self.path)
+
+    def _tree(self, commit):
+        from dulwich.objectspec import parse_commit
+        return parse_commit(self.repo, commit).tree
+
+    def _changes(self, curr_commit, next_commit):
+        from dulwich.diff_tree import tree_changes, RenameDetector
+        store = self.repo.object_store
+        return tree_changes(store, self._tree(curr_commit), self._tree(next_commit),
+                            rename_detector=RenameDetector(store,
+                                rename_threshold=git_diff.RENAME_THRESHOLD,
+                                max_files=git_diff.RENAME_LIMIT))
+
+    def _lines(self, entry):
+        if entry is None or entry.sha is None:
+            return None
+        data = self.repo.object_store[entry.sha].data
+        if b"\0" in data[:8000]:
+            return None
+        return data.splitlines()
+
+    def _hunks(self, change):
+        old = self._lines(change.old) if change.type != "add" else []
+        new = self._lines(change.new) if change.type != "delete" else []
+        if old is None or new is None:
+            return None
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        hunks = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            # Like git, an empty side starts at the line before the change.
+            hunks.append((i1 + 1 if i2 > i1 else i1, i2 - i1,
+                          j1 + 1 if j2 > j1 else j1, j2 - j1))
+        return hunks
+
+    @staticmethod
+    def _path(entry):
+        return entry.path.decode("utf-8", "surrogateescape")
+
+    def _diff_index(self, curr_commit, next_commit):
+        index = git_diff.DiffIndex(curr_commit, next_commit)
+        for change in self._changes(curr_commit, next_commit):
+            old_path = self._path(change.old if change.type != "add" else change.new)
+            new_path = self._path(change.new if change.type != "delete" else change.old)
+            fd = git_diff.FileDiff(old_path, new_path)
+            fd.status = {"add": "A", "delete": "D", "rename": "R"}.get(change.type, "M")
+            for s, c, t, d in self._hunks(change) or []:
+                fd.add_hunk(s, _count(c), t, _count(d))
+            index.files[old_path] = fd
+        return index
+
+    def numstat(self, curr_commit, next_commit):
+        stats = []
+        for change in self._changes(curr_commit, next_commit):
+            path = self._path(change.new if change.type != "delete" else change.old)
+            if change.type == "rename":
+                path = "{} => {}".format(self._path(change.old), path)
+            hunks = self._hunks(change)
+            if hunks is None:
+                stats.append(["-", "-", path])
+            else:
+                stats.append([str(sum(h[3] for h in hunks)), str(sum(h[1] for h in hunks)), path])
+        return stats
+
+    def read_blob(self, commit, path):
+        from dulwich.object_store import tree_lookup_path
+        store = self.repo.object_store
+        _, sha = tree_lookup_path(store.__getitem__, self._tree(commit), path.encode())
+        return store[sha].data
+
+    def list_tree(self, commit):
+        store = self.repo.object_store
+        return {entry.path.decode("utf-8", "surrogateescape"): entry.sha.decode("ascii")
+                for entry in store.iter_tree_contents(self._tree(commit))}
+
+
+# Backends in the order they are tried by default, and every backend by name
+BACKENDS = [Pygit2Backend, SubprocessBackend]
+ALL_BACKENDS = [Pygit2Backend, DulwichBackend, SubprocessBackend]
+
+_backends = {}
+
+def get_backend(path=".", name=None):
+    """
+        Returns the git backend for the repository at path, creating it the
+        first time. By default pygit2 is used if it is installed, falling
+        back to the git executable.
+
+        name: "pygit2", "dulwich" or "subprocess" to pick one explicitly
+    """
+    key = (os.path.abspath(path), name)
+    if key in _backends:
+        return _backends[key]
+
+    backend = None
+    for cls in (BACKENDS if name is None else ALL_BACKENDS):
+        if name is not None and cls.name != name:
+            continue
+        try:
+            backend = cls(path)
+            break
+        except ImportError:
+            if name is not None:
+                raise
+    _backends[key] = backend
+    return backend
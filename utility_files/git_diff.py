@@ -0,0 +1,195 @@
+import codecs
+import re
+import subprocess
+
+HUNK_RE = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# git's defaults for -M and diff.renameLimit. They are passed explicitly so
+# the user's git config does not change which files count as renamed, and
+# the in-process backends are given the same values.
+RENAME_THRESHOLD = 50
+RENAME_LIMIT = 1000
+DIFF_ARGS = ["diff", "-U0", "-M{}%".format(RENAME_THRESHOLD), "-l{}".format(RENAME_LIMIT),
+             "--diff-algorithm=myers", "--indent-heuristic", "--no-color", "--no-ext-diff"]
+
+
+class FileDiff:
+    """
+        The changes made to one file between two commits.
+
+        status: "A", "D", "M" or "R", as in git diff --name-status
+        hunks: list of (old start, old count, new start, new count) straight
+               from the hunk headers of a zero context diff
+        srcs, dsts: the hunks as (start, end) tuples, the format the bug
+                    trackers have always compared bug locations against
+    """
+    def __init__(self, old_path, new_path):
+        self.status = "M"
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+        self.srcs = []
+        self.dsts = []
+
+    def add_hunk(self, old_start, old_count, new_start, new_count):
+        self.hunks.append((old_start,
+                           1 if old_count is None else old_count,
+                           new_start,
+                           1 if new_count is None else new_count))
+        self.srcs.append(_legacy_range(old_start, old_count))
+        self.dsts.append(_legacy_range(new_start, new_count))
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+def _legacy_range(start, count):
+    if count is None:
+        return (start, start)
+    return (start, start + count)
+
+
+class DiffIndex:
+    """
+        Every file change between two commits, parsed from a single diff.
+        Files are keyed by their path in the older commit, so a renamed file
+        is found under its old name.
+    """
+    def __init__(self, curr_commit, next_commit):
+        self.curr_commit = curr_commit
+        self.next_commit = next_commit
+        self.files = {}
+
+    def __contains__(self, fname):
+        return fname in self.files
+
+    def __getitem__(self, fname):
+        return self.files[fname]
+
+    def files_changed(self):
+        """
+            return: dictionary from filename to [status], or
+                    ["R", renamed to] for renames
+        """
+        to_return = {}
+        for f, fd in self.files.items():
+            to_return[f] = [fd.status]
+            if fd.status == 'R':
+                to_return[f].append(fd.new_path)
+        return to_return
+
+    def renames(self):
+        """
+            return: dictionary from old path to new path for every rename
+        """
+        return {f: fd.new_path for f, fd in self.files.items() if fd.status == 'R'}
+
+
+def _unquote(path):
+    """
+        git C-quotes paths with unusual characters even with core.quotepath off.
+    """
+    if path.startswith(b'"') and path.endswith(b'"'):
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path
+
+
+def _decode(path):
+    return path.decode("utf-8", "surrogateescape")
+
+
+def _strip_prefix(path):
+    path = _unquote(path)
+    return path[2:] if path[:2] in (b"a/", b"b/") else path
+
+
+def _header_paths(rest):
+    """
+        Splits the "a/<old> b/<new>" part of a "diff --git" line. Unquoted,
+        the two paths are only unambiguous when they are equal, which is the
+        case for everything but renames; those are read from the
+        extended header lines instead.
+    """
+    if rest.startswith(b'"'):
+        i = 1
+        while rest[i:i + 1] != b'"':
+            i += 2 if rest[i:i + 1] == b"\\" else 1
+        old, new = rest[:i + 1], rest[i + 2:]
+    elif rest.endswith(b'"'):
+        split = rest.rindex(b' "')
+        old, new = rest[:split], rest[split + 1:]
+    else:
+        half = (len(rest) - 1) // 2
+        old, new = rest[:half], rest[half + 1:]
+    return _decode(_strip_prefix(old)), _decode(_strip_prefix(new))
+
+
+def parse_diff(lines, curr_commit=None, next_commit=None):
+    """
+        Parses "git diff -U0 -M" output into a DiffIndex in a single pass.
+
+        lines: iterable of bytes lines, e.g. a subprocess pipe
+    """
+    index = DiffIndex(curr_commit, next_commit)
+    fd = None
+    old_left = new_left = 0
+
+    for line in lines:
+        line = line.rstrip(b"\n")
+
+        # Inside a hunk every line is content, even one that starts "---".
+        if old_left > 0 or new_left > 0:
+            if line.startswith(b"-"):
+                old_left -= 1
+            elif line.startswith(b"+"):
+                new_left -= 1
+            elif line.startswith(b" "):
+                old_left -= 1
+                new_left -= 1
+            continue
+
+        if line.startswith(b"diff --git "):
+            old_path, new_path = _header_paths(line[len(b"diff --git "):])
+            fd = FileDiff(old_path, new_path)
+            index.files[old_path] = fd
+        elif fd is None:
+            continue
+        elif line.startswith(b"@@ "):
+            m = HUNK_RE.match(line)
+            if m is None:
+                continue
+            old_count = None if m.group(2) is None else int(m.group(2))
+            new_count = None if m.group(4) is None else int(m.group(4))
+            fd.add_hunk(int(m.group(1)), old_count, int(m.group(3)), new_count)
+            old_left = 1 if old_count is None else old_count
+            new_left = 1 if new_count is None else new_count
+        elif line.startswith(b"new file mode"):
+            fd.status = "A"
+        elif line.startswith(b"deleted file mode"):
+            fd.status = "D"
+        elif line.startswith(b"rename from "):
+            del index.files[fd.old_path]
+            fd.old_path = _decode(_unquote(line[len(b"rename from "):]))
+            index.files[fd.old_path] = fd
+        elif line.startswith(b"rename to "):
+            fd.new_path = _decode(_unquote(line[len(b"rename to "):]))
+            fd.status = "R"
+    return index
+
+
+def diff_index(curr_commit, next_commit, cwd=None):
+    """
+        Runs one zero context, rename detecting git diff between two commits
+        and indexes every changed file and hunk. The diff is parsed as git
+        streams it. Callers go through GitBackend.diff_index, which caches
+        the last few commit pairs per repository.
+
+        cwd: repository to run git in, defaults to the current directory
+    """
+    proc = subprocess.Popen(["git", "-c", "core.quotepath=off"] + DIFF_ARGS + [curr_commit, next_commit],
+        stdout=subprocess.PIPE, cwd=cwd)
+    try:
+        index = parse_diff(proc.stdout, curr_commit, next_commit)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    return index
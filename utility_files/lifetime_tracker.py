@@ -0,0 +1,254 @@
+"""
+    Bug lifetime tracking over a list of saved bug reports, as a resumable
+    stage. The tracker follows every bug of the first report, and every bug
+    introduced after it, from one snapshot to the next until it is resolved.
+
+    Every few steps its whole state is written to a checkpoint: the tracked
+    bugs and the EventsReport as columns, and the next step. Checkpoints are
+    written to a temporary file and renamed into place, so a crash leaves the
+    previous checkpoint intact, and they record a digest of the snapshot list
+    so a run only resumes against the snapshots it was started on.
+"""
+import hashlib
+import os
+import pickle
+import time
+from datetime import timedelta
+from utility.bug_report import Bug, LazyBugReport
+from utility.bug_index import BugIndex
+from utility.event_report import EventsReport
+from utility.git_backend import get_backend
+from utility.line_map import LineMap
+from utility.report_diff import added_bugs
+
+CHECKPOINT_VERSION = 2
+BUG_COLUMNS = ("fname", "desc", "code", "bug_type", "severity", "loc_start", "loc_end",
+               "commit", "fingerprint")
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def check_if_bug_resolved(bug, new_br, d):
+    """
+        Given a bug and a bug report, tries to find a matching
+        bug in the new bug report for this bug. If a match is found,
+        then the bug is updated to the matched bug. Otherwise, the
+        bug is considered resolved.
+
+        d: The destination locs of the bug
+        return: Whether or not the bug was resolved.
+    """
+    any_same_bug = False
+
+    # bug.fname is the file's name in new_br's commit (its new name if it
+    # was renamed), and the file was not deleted. So if new_br has no bugs
+    # in the file, the bug must have been resolved.
+    if bug.fname not in new_br.file_map:
+        return True
+
+
+    for bug_in_fname in new_br.file_map[bug.fname]:
+        same_bug = d[0] <= bug_in_fname.locs[0] <= d[1]
+        same_bug = d[0] <= bug_in_fname.locs[1] <= d[1] and same_bug
+        same_bug = bug_in_fname.desc == bug.desc and same_bug
+        same_bug = bug_in_fname.code == bug.code and same_bug
+
+        # Update the bug
+        if same_bug:
+            any_same_bug = True
+            bug = bug_in_fname
+            print("Bug match found and updated")
+            break
+
+    resolved = not any_same_bug
+    return resolved
+
+def snapshots_digest(snapshots):
+    """
+        return: hex digest of the commits of a snapshot list, in order
+    """
+    h = hashlib.sha1()
+    for snapshot in snapshots:
+        h.update(snapshot[1].encode("ascii") + b"\n")
+    return h.hexdigest()
+
+
+class LifetimeTracker:
+    """
+        snapshots: list of (depth, commit, timestamp) of the saved reports,
+                   in the order to walk them
+        bug_list: the bugs to track from the first snapshot
+        report_args: keyword arguments to open each snapshot's LazyBugReport
+                     with (dir, save_dir, tool, ...)
+    """
+    def __init__(self, snapshots, bug_list, report_args, debug=True):
+        self.snapshots = snapshots
+        self.report_args = report_args
+        self.er = EventsReport(bug_list, debug, snapshots[0][0] if snapshots else -1)
+        self.index = BugIndex(bug_list)
+        # The next step compares snapshot step - 1 to snapshot step
+        self.step = 1
+
+    @property
+    def bug_list(self):
+        return self.er.bug_list
+
+    def done(self):
+        return self.step >= len(self.snapshots)
+
+    def _report(self, i):
+        return LazyBugReport(self.snapshots[i][1], **self.report_args)
+
+    def diff(self, curr_commit, next_commit):
+        """
+            return: DiffIndex of a commit step
+        """
+        return get_backend().diff_index(curr_commit, next_commit)
+
+    def files_changed(self, diff):
+        """
+            return: the file changes of a commit step this tracker follows
+        """
+        return diff.files_changed()
+
+    def find_new_bugs(self, curr_br, new_br, f_changes):
+        """
+            return: the bugs new_br introduced in the changed files
+        """
+        return added_bugs(curr_br, new_br, f_changes)
+
+    def advance(self, curr_br, new_br):
+        """
+            Follows the bugs from snapshot step - 1 (curr_br) to snapshot
+            step (new_br): resolves the live bugs a hunk touched and no
+            longer found, moves the others to their new lines and starts
+            tracking the bugs new_br introduced.
+        """
+        curr_commit = self.snapshots[self.step - 1][1]
+        next_commit = self.snapshots[self.step][1]
+        depth = self.snapshots[self.step][0]
+        diff = self.diff(curr_commit, next_commit)
+        f_changes = self.files_changed(diff)
+
+        ### Find new bugs ###
+        new_bugs = self.find_new_bugs(curr_br, new_br, f_changes)
+
+        ### Check for resolved bugs ###
+        # Only the live bugs of changed files are looked at
+        bug_list = self.bug_list
+        for fname, change in f_changes.items():
+            if fname not in self.index:
+                continue
+            if change[0] == "D":
+                ids = self.index.ids(fname)
+                self.er.update_lost(ids)
+                self.index.discard(fname, ids)
+                continue
+
+            # The hunks of a renamed file are kept under its old path
+            fd = diff[fname]
+            if change[0] == "R":
+                self.index.rename(fname, change[1], bug_list)
+                fname = change[1]
+                if not fd.hunks:
+                    continue
+            line_map = LineMap(fd.hunks)
+
+            # Bugs a hunk touched are looked for in the new report, the
+            # others are moved to their new line numbers.
+            resolved_ids = []
+            for j, ids in self.index.touched(fname, line_map):
+                for idx in ids:
+                    resolved = check_if_bug_resolved(bug_list[idx], new_br, fd.dsts[j])
+                    self.er.update_resolved(idx, depth, resolved)
+                    if resolved:
+                        resolved_ids.append(idx)
+            self.index.discard(fname, resolved_ids)
+            self.index.remap(fname, line_map, bug_list)
+
+        # Add new bugs found in next commit to bug list
+        print("New bugs: {}".format(len(new_bugs)))
+        self.er.seen(depth)
+        self.index.add(new_bugs, range(len(bug_list), len(bug_list) + len(new_bugs)))
+        self.er.add_bugs(new_bugs, depth)
+        self.step += 1
+
+    def run(self, checkpoint=None, every=10):
+        """
+            Walks the remaining snapshots, writing a checkpoint every `every`
+            steps and once done when checkpoint is set.
+        """
+        start_time = time.time()
+        print("Running static analysis over time on {} bugs from step {}/{}".format(
+            len(self.bug_list), self.step, len(self.snapshots)))
+        print("===========")
+
+        curr_br = self._report(self.step - 1) if not self.done() else None
+        while not self.done():
+            print("Commit {} {}/{}".format(self.snapshots[self.step - 1][1], self.step + 1, len(self.snapshots)))
+            new_br = self._report(self.step)
+            self.advance(curr_br, new_br)
+            curr_br.close()
+            curr_br = new_br
+            print("===========")
+
+            if checkpoint is not None and (self.step % every == 0 or self.done()):
+                self.save(checkpoint)
+        if curr_br is not None:
+            curr_br.close()
+        print("Tracking time: {}".format(str(timedelta(seconds=time.time() - start_time))))
+
+    def save(self, path):
+        """
+            Writes the tracker state to path, atomically.
+        """
+        bug_list = self.bug_list
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'snapshots': snapshots_digest(self.snapshots),
+            'step': self.step,
+            # Columns of interned strings pickle to one copy per distinct value
+            'bugs': {col: [getattr(bug, col) for bug in bug_list] for col in BUG_COLUMNS + ("notes",)},
+            'events': self.er.state(),
+        }
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        print("Saved tracker checkpoint at step {}/{} to {}".format(self.step, len(self.snapshots), path))
+
+    @classmethod
+    def load(cls, path, snapshots, report_args, debug=True):
+        """
+            Resumes a tracker from the checkpoint at path.
+
+            snapshots: must be the snapshot list the checkpoint was made with
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise CheckpointError("unsupported checkpoint version {}".format(state.get('version')))
+        if state['snapshots'] != snapshots_digest(snapshots):
+            raise CheckpointError("{} was made with a different list of snapshots".format(path))
+
+        cols = state['bugs']
+        # Checkpoints made before bugs kept their notes have no notes column
+        notes = cols.get('notes', [None] * len(cols['fname']))
+        bug_list = [Bug(fname, desc, code, bug_type, severity, (start, end), commit, fingerprint, n)
+                    for fname, desc, code, bug_type, severity, start, end, commit, fingerprint, n
+                    in zip(*(cols[col] for col in BUG_COLUMNS), notes)]
+
+        tracker = cls.__new__(cls)
+        tracker.snapshots = snapshots
+        tracker.report_args = report_args
+        tracker.er = EventsReport(bug_list, debug)
+        tracker.er.set_state(state['events'])
+        live = tracker.er.live().nonzero()[0].tolist()
+        tracker.index = BugIndex([bug_list[idx] for idx in live], live)
+        tracker.step = state['step']
+        print("Resumed tracker at step {}/{} from {}".format(tracker.step, len(snapshots), path))
+        return tracker
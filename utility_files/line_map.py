@@ -0,0 +1,79 @@
+"""
+    Maps line numbers of a file in one commit to the next commit through the
+    hunks of a zero context diff, for every bug of the file at once.
+
+    Positions are kept doubled so both kinds of hunk fit in one sorted
+    array: a hunk replacing old lines s..e spans [2s, 2e], and a pure
+    insertion after old line s sits at 2s + 1, between lines s and s + 1.
+    A span of lines [a, b] is then touched by the hunks that start at or
+    before 2b and end at or after 2a, and every hunk ending before 2a
+    shifts it by that hunk's change in line count.
+"""
+import numpy as np
+
+
+class LineMap:
+    """
+        The cumulative offset table of one file's hunks.
+
+        hunks: list of (old start, old count, new start, new count), as in
+               FileDiff.hunks
+    """
+    def __init__(self, hunks):
+        hunks = np.array(hunks, dtype=np.int64).reshape(-1, 4)
+        self.old_start, self.old_count, self.new_start, self.new_count = hunks.T
+        insertion = self.old_count == 0
+        self.first = np.where(insertion, 2 * self.old_start + 1, 2 * self.old_start)
+        self.last = np.where(insertion, 2 * self.old_start + 1,
+                             2 * (self.old_start + self.old_count - 1))
+        # offset[k] is the shift of a line after the first k hunks
+        self.offset = np.concatenate(([0], np.cumsum(self.new_count - self.old_count)))
+
+    def __len__(self):
+        return len(self.old_start)
+
+    def remap(self, starts, ends=None):
+        """
+            starts, ends: first and last line of every span, ends defaults
+                          to starts
+            return: (new starts, new ends, touched, hunk) where touched tells
+                    which spans overlap a hunk and hunk is the index of the
+                    first hunk they overlap, -1 for the others. Untouched
+                    spans are shifted by the offset of all preceding hunks;
+                    touched ones are moved into the new side of their hunk.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = starts if ends is None else np.asarray(ends, dtype=np.int64)
+
+        before = np.searchsorted(self.last, 2 * starts, side='left')
+        upto = np.searchsorted(self.first, 2 * ends, side='right')
+        touched = upto > before
+
+        shift = self.offset[before]
+        new_starts = starts + shift
+        new_ends = ends + shift
+
+        hunk = np.where(touched, before, -1)
+        if touched.any():
+            k = before[touched]
+            low = self.new_start[k]
+            high = low + np.maximum(self.new_count[k], 1) - 1
+            new_starts[touched] = np.clip(new_starts[touched], low, high)
+            new_ends[touched] = np.clip(new_ends[touched], low, high)
+        return new_starts, new_ends, touched, hunk
+
+    def remap_bugs(self, bugs):
+        """
+            Moves the bugs no hunk touches to their lines in the new commit.
+
+            bugs: list of Bugs of this file
+            return: (touched, hunk) as returned by remap
+        """
+        if not bugs:
+            return np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64)
+        starts = np.fromiter((bug.loc_start for bug in bugs), dtype=np.int64, count=len(bugs))
+        ends = np.fromiter((bug.loc_end for bug in bugs), dtype=np.int64, count=len(bugs))
+        new_starts, new_ends, touched, hunk = self.remap(starts, ends)
+        for i in np.flatnonzero(~touched):
+            bugs[i].locs = (int(new_starts[i]), int(new_ends[i]))
+        return touched, hunk
@@ -0,0 +1,103 @@
+from collections import deque
+
+
+def _join(old_keys, new_keys):
+    """
+        Multiset hash join of the bugs of a file in two reports on their
+        fingerprints. Bugs with the same fingerprint are paired off in
+        order, so a bug that appears twice in the new file but once in the
+        old one counts as one persisting and one added bug.
+
+        return: (positions of the added new bugs, positions of the removed
+                old bugs, (old position, new position) persisting pairs)
+    """
+    by_key = {}
+    for i, key in enumerate(old_keys):
+        if key not in by_key:
+            by_key[key] = deque()
+        by_key[key].append(i)
+
+    added = []
+    persisting = []
+    for j, key in enumerate(new_keys):
+        matches = by_key.get(key)
+        if matches:
+            persisting.append((matches.popleft(), j))
+        else:
+            added.append(j)
+
+    removed = [i for matches in by_key.values() for i in matches]
+    return added, removed, persisting
+
+def _file_keys(old_br, new_br, f, change):
+    """
+        Reads the fingerprints of the bugs of a changed file from both
+        reports. Columnar reports hand them over without building any bug.
+
+        return: (path of the file in new_br, old fingerprints, new
+                fingerprints), or None if neither report has bugs in it
+    """
+    status = change[0]
+    dest = change[1] if status == 'R' else f
+
+    # Fast path: nothing to compare in a file neither report has bugs in.
+    in_old = f in old_br.file_map and status != 'A'
+    in_new = dest in new_br.file_map and status != 'D'
+    if not in_old and not in_new:
+        return None
+
+    new_keys = new_br.fingerprints(dest) if in_new else []
+    if not in_old:
+        old_keys = []
+    elif dest == f:
+        old_keys = old_br.fingerprints(f)
+    else:
+        old_keys = [bug.compute_fingerprint(dest) for bug in old_br.file_map[f]]
+    return dest, old_keys, new_keys
+
+def diff_reports(old_br, new_br, files_changed):
+    """
+        Finds the bugs that were added, removed or kept between two
+        consecutive bug reports, looking only at the files that changed.
+        Bugs in files that did not change are not listed; they persist.
+
+        old_br: BugReport (or LazyBugReport) of the older commit
+        new_br: BugReport of the newer commit
+        files_changed: dictionary from DiffIndex.files_changed(), i.e.
+                       filename to [status] or ["R", renamed to]
+        return: (added, removed, persisting) where added holds bugs of new_br,
+                removed holds bugs of old_br and persisting holds
+                (old bug, new bug) pairs
+    """
+    added = []
+    removed = []
+    persisting = []
+
+    for f, change in files_changed.items():
+        keys = _file_keys(old_br, new_br, f, change)
+        if keys is None:
+            continue
+        dest, old_keys, new_keys = keys
+
+        a, r, p = _join(old_keys, new_keys)
+        added += new_br.bugs_at(dest, a)
+        removed += old_br.bugs_at(f, r)
+        if p:
+            persisting += zip(old_br.bugs_at(f, [i for i, _ in p]),
+                              new_br.bugs_at(dest, [j for _, j in p]))
+
+    return added, removed, persisting
+
+def added_bugs(old_br, new_br, files_changed):
+    """
+        The bugs diff_reports returns as added, for callers that need no
+        more. Only fingerprints are compared, so the only bugs built are the
+        added ones.
+    """
+    added = []
+    for f, change in files_changed.items():
+        keys = _file_keys(old_br, new_br, f, change)
+        if keys is not None:
+            dest, old_keys, new_keys = keys
+            added += new_br.bugs_at(dest, _join(old_keys, new_keys)[0])
+    return added
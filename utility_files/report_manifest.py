@@ -0,0 +1,145 @@
+"""
+    Index of the bug reports saved in a directory, so finding a commit's
+    report does not need a listdir of the whole directory.
+
+    The manifest is a manifest.jsonl file in the save directory with one
+    JSON entry per saved report:
+
+        {"sha": ..., "file": ..., "tool": ..., "size": ..., "nbugs": ..., "created": ...}
+
+    Entries are only ever appended, one line per write, so workers saving
+    reports at the same time do not need to coordinate; a later entry for a
+    sha replaces an earlier one. Reports are now saved under their full
+    commit hash. Reports saved before under a 5 character prefix are
+    entered by that prefix, and returned for any commit that starts with
+    it: callers check the full commit the report stores before using it.
+"""
+import json
+import os
+import re
+import time
+
+MANIFEST = "manifest.jsonl"
+NAME_RE = re.compile(r"^bug_report_([0-9a-fA-F]+)(\.brc|\.txt|\.bin)$")
+LEGACY_PREFIX = 5
+# Lower is preferred when a commit has reports in several formats
+PREFERENCE = {".brc": 0, ".txt": 1, ".bin": 2}
+
+
+class Manifest:
+    def __init__(self, save_dir):
+        self.save_dir = os.path.abspath(save_dir)
+        self.path = os.path.join(self.save_dir, MANIFEST)
+        self.entries = {}
+        # Entries of reports saved under a 5 character prefix, by prefix
+        self.legacy = {}
+        self._offset = 0
+        if os.path.exists(self.path):
+            self.refresh()
+        else:
+            self.rebuild()
+
+    def __contains__(self, commit):
+        return self.lookup(commit) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _apply(self, entry):
+        old = self.entries.get(entry['sha'])
+        ext = os.path.splitext(entry['file'])[1]
+        if old is None or PREFERENCE.get(ext, 3) <= PREFERENCE.get(os.path.splitext(old['file'])[1], 3):
+            self.entries[entry['sha']] = entry
+            m = NAME_RE.match(entry['file'])
+            if m is not None and len(m.group(1)) == LEGACY_PREFIX:
+                self.legacy[m.group(1)] = entry
+
+    def refresh(self):
+        """
+            Reads the entries other processes appended since the last read.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A line is only complete once its newline is written.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].split(b"\n"):
+            if line:
+                self._apply(json.loads(line.decode("utf-8")))
+        self._offset += end
+
+    def rebuild(self):
+        """
+            Builds the manifest from the reports in the directory. This is
+            the only listdir, done once for directories saved before there
+            was a manifest.
+        """
+        print("...Building the report manifest of {}...".format(self.save_dir))
+        self.entries = {}
+        self.legacy = {}
+        lines = []
+        for f in sorted(os.listdir(self.save_dir)):
+            m = NAME_RE.match(f)
+            if m is None:
+                continue
+            st = os.stat(os.path.join(self.save_dir, f))
+            if st.st_size == 0:
+                continue
+            entry = {'sha': m.group(1), 'file': f, 'tool': None, 'size': st.st_size,
+                     'nbugs': None, 'created': st.st_mtime}
+            self._apply(entry)
+            lines.append(json.dumps(entry) + "\n")
+
+        tmp = "{}.tmp{}".format(self.path, os.getpid())
+        with open(tmp, "w") as out:
+            out.write("".join(lines))
+        os.replace(tmp, self.path)
+        self._offset = os.path.getsize(self.path)
+
+    def add(self, sha, file, tool=None, nbugs=None):
+        """
+            Records that the report of sha was saved to file.
+        """
+        entry = {'sha': sha, 'file': file, 'tool': tool,
+                 'size': os.path.getsize(os.path.join(self.save_dir, file)),
+                 'nbugs': nbugs, 'created': time.time()}
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+        self._apply(entry)
+
+    def _get(self, commit):
+        entry = self.entries.get(commit)
+        if entry is None and len(commit) > LEGACY_PREFIX:
+            entry = self.legacy.get(commit[:LEGACY_PREFIX])
+        return entry
+
+    def lookup(self, commit, refresh=True):
+        """
+            return: the entry of the report saved for commit, or None
+
+            refresh: on a miss, read what other processes appended first.
+                     Callers looking up many commits call refresh() once
+                     and pass False, so misses do not reopen the manifest.
+        """
+        entry = self._get(commit)
+        if entry is None and refresh:
+            self.refresh()
+            entry = self._get(commit)
+        if entry is not None and not os.path.exists(os.path.join(self.save_dir, entry['file'])):
+            return None
+        return entry
+
+
+_manifests = {}
+
+def get_manifest(save_dir):
+    """
+        return: the Manifest of save_dir, loaded once per process
+    """
+    key = os.path.abspath(save_dir)
+    if key not in _manifests:
+        _manifests[key] = Manifest(save_dir)
+    return _manifests[key]
@@ -0,0 +1,384 @@
+"""
+    Versioned binary columnar format for bug reports.
+
+    A report file is a small header followed by a table of named sections:
+
+        magic (4s) | version (H) | reserved (H) | number of sections (I)
+        section table: name (8s) | offset (Q) | length (Q)   x number of sections
+        section bodies, each aligned to 8 bytes
+
+    The "meta" section is the JSON encoded report metadata (commit, tool, ...).
+    fname/desc/code/bug_type/severity/commit are dictionary encoded string
+    columns: a dictionary of distinct values followed by one uint32 code per bug.
+    locs is a flat int32 array of (start, end) pairs.
+
+    The optional "fprint" section holds every bug's uint64 Bug.fingerprint,
+    so loading a report never needs to rehash the bugs.
+
+    The optional "notes" section is a string column like the ones above
+    holding every bug's Bug.notes as JSON, or "" for bugs without notes. It
+    is only written when some bug of the report has notes.
+
+    The optional "fileidx" section maps every fname to the rows of its bugs:
+    uint32 offsets (one per fname dictionary entry, plus one) into a uint32
+    list of row numbers grouped by fname. Readers that find a section they do
+    not know about ignore it, so new optional sections do not bump the version.
+
+    Nothing in the file is evaluated as Python, so loading a report is a
+    handful of array copies plus one decode per distinct string.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"BRZC"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHI")
+SECTION = struct.Struct("<8sQQ")
+ALIGN = 8
+
+STRING_COLUMNS = ["fname", "desc", "code", "bug_type", "severity", "commit"]
+META_FIELDS = ["commit", "dir", "tool", "command", "clean", "fname"]
+
+assert array("I").itemsize == 4 and array("i").itemsize == 4 and array("Q").itemsize == 8
+
+
+class ReportFormatError(Exception):
+    pass
+
+
+def section_name(col):
+    return col.replace("_", "")
+
+
+def _to_le(arr):
+    """
+        Arrays are always stored little endian on disk.
+    """
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le(typecode, buf):
+    arr = array(typecode)
+    arr.frombytes(buf)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def dictionary_encode(values):
+    """
+        return: (list of distinct values in first seen order, array of uint32
+                codes, one per value)
+    """
+    lookup = {}
+    codes = array("I")
+    for v in values:
+        code = lookup.get(v)
+        if code is None:
+            code = len(lookup)
+            lookup[v] = code
+        codes.append(code)
+    return list(lookup), codes
+
+
+def encode_string_column(values):
+    """
+        Dictionary encodes a list of strings.
+
+        return: bytes laid out as
+                ndict (I) | offsets (I x ndict+1) | utf-8 blob | pad | codes (I x nrows)
+    """
+    distinct, codes = dictionary_encode(values)
+    return _pack_string_column(distinct, codes)
+
+
+def _pack_string_column(distinct, codes):
+    offsets = array("I", [0])
+    blob = bytearray()
+    for v in distinct:
+        blob += v.encode("utf-8", "surrogatepass")
+        offsets.append(len(blob))
+
+    out = bytearray(struct.pack("<I", len(distinct)))
+    out += _to_le(offsets)
+    out += blob
+    out += b"\0" * (-len(out) % 4)
+    out += _to_le(codes)
+    return bytes(out)
+
+
+def encode_file_index(ndict, codes):
+    """
+        Groups row numbers by their fname code, keeping rows in order.
+
+        return: bytes laid out as offsets (I x ndict+1) | rows (I x nrows)
+    """
+    counts = [0] * (ndict + 1)
+    for c in codes:
+        counts[c + 1] += 1
+    for i in range(ndict):
+        counts[i + 1] += counts[i]
+
+    offsets = array("I", counts)
+    rows = array("I", bytes(4 * len(codes)))
+    fill = counts[:-1]
+    for row, c in enumerate(codes):
+        rows[fill[c]] = row
+        fill[c] += 1
+    return _to_le(offsets) + _to_le(rows)
+
+
+def decode_dictionary(buf):
+    """
+        Decodes only the dictionary part of a string column.
+
+        return: (list of distinct strings, byte offset at which the codes start)
+    """
+    (ndict,) = struct.unpack_from("<I", buf, 0)
+    offsets = _from_le("I", buf[4:4 + 4 * (ndict + 1)])
+    start = 4 + 4 * (ndict + 1)
+    blob = bytes(buf[start:start + offsets[-1]])
+    values = [blob[offsets[i]:offsets[i + 1]].decode("utf-8", "surrogatepass")
+              for i in range(ndict)]
+    codes_at = start + offsets[-1]
+    codes_at += -codes_at % 4
+    return values, codes_at
+
+
+def decode_string_column(buf, nrows):
+    """
+        return: (list of distinct strings, array of uint32 codes)
+    """
+    values, codes_at = decode_dictionary(buf)
+    codes = _from_le("I", buf[codes_at:codes_at + 4 * nrows])
+    return values, codes
+
+
+def encode_notes(notes):
+    return json.dumps(notes) if notes else ""
+
+
+def decode_notes(value):
+    return json.loads(value) if value else None
+
+
+def _bug_meta(br):
+    meta = {f: getattr(br, f) for f in META_FIELDS}
+    meta["nbugs"] = len(br.bugs)
+    return meta
+
+
+def write_report(br, path):
+    """
+        Writes the bugs and metadata of a BugReport to path in the
+        columnar format, atomically.
+    """
+    bugs = br.bugs
+    sections = [("meta", json.dumps(_bug_meta(br)).encode("utf-8"))]
+    for col in STRING_COLUMNS:
+        distinct, codes = dictionary_encode([getattr(b, col) for b in bugs])
+        sections.append((section_name(col), _pack_string_column(distinct, codes)))
+        if col == "fname":
+            sections.append(("fileidx", encode_file_index(len(distinct), codes)))
+
+    locs = array("i")
+    for b in bugs:
+        locs.append(b.loc_start)
+        locs.append(b.loc_end)
+    sections.append(("locs", _to_le(locs)))
+    sections.append(("fprint", _to_le(array("Q", [b.fingerprint for b in bugs]))))
+    if any(b.notes for b in bugs):
+        sections.append(("notes", encode_string_column([encode_notes(b.notes) for b in bugs])))
+
+    # Written to a temporary file first so readers (and parallel writers)
+    # never see a partially written report.
+    tmp = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(_pack(sections))
+    os.replace(tmp, path)
+
+
+def _pack(sections):
+    table_size = HEADER.size + SECTION.size * len(sections)
+    offset = table_size + (-table_size % ALIGN)
+
+    table = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(sections)))
+    body = bytearray()
+    for name, data in sections:
+        table += SECTION.pack(name.encode("ascii"), offset + len(body), len(data))
+        body += data
+        body += b"\0" * (-len(body) % ALIGN)
+    table += b"\0" * (-len(table) % ALIGN)
+    return bytes(table + body)
+
+
+def read_sections(buf):
+    """
+        Parses the header and section table of a columnar report.
+
+        buf: bytes, bytearray, memoryview or mmap holding the whole file
+        return: (version, dictionary from section name to memoryview)
+    """
+    view = memoryview(buf)
+    if len(view) < HEADER.size:
+        raise ReportFormatError("truncated bug report")
+    magic, version, _, nsections = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ReportFormatError("not a columnar bug report")
+    if version > FORMAT_VERSION:
+        raise ReportFormatError("unsupported bug report version {}".format(version))
+
+    sections = {}
+    for i in range(nsections):
+        name, offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+        if offset + length > len(view):
+            raise ReportFormatError("truncated bug report")
+        sections[name.rstrip(b"\0").decode("ascii")] = view[offset:offset + length]
+    return version, sections
+
+
+def read_report(path):
+    """
+        Reads a columnar report.
+
+        return: (metadata dictionary, dictionary from column name to list of
+                values). String columns share one str object per distinct value.
+    """
+    with open(path, "rb") as f:
+        buf = f.read()
+    _, sections = read_sections(buf)
+    meta = json.loads(bytes(sections["meta"]).decode("utf-8"))
+    nrows = meta["nbugs"]
+
+    columns = {}
+    for col in STRING_COLUMNS:
+        values, codes = decode_string_column(sections[section_name(col)], nrows)
+        columns[col] = [values[c] for c in codes]
+
+    locs = _from_le("i", sections["locs"])
+    columns["locs"] = list(zip(locs[0::2], locs[1::2]))
+    if "fprint" in sections:
+        columns["fingerprint"] = list(_from_le("Q", sections["fprint"]))
+    else:
+        columns["fingerprint"] = [None] * nrows
+    if "notes" in sections:
+        values, codes = decode_string_column(sections["notes"], nrows)
+        notes = [decode_notes(v) for v in values]
+        columns["notes"] = [notes[c] for c in codes]
+    else:
+        columns["notes"] = [None] * nrows
+    return meta, columns
+
+
+class MappedReport:
+    """
+        Read-only, memory-mapped view of a columnar report. Nothing but the
+        header, the section table and the metadata is read up front; bug
+        fields are decoded row by row and distinct strings are decoded once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.version, self._sections = read_sections(self._mm)
+        self.meta = json.loads(bytes(self._sections["meta"]).decode("utf-8"))
+        self.nbugs = self.meta["nbugs"]
+        self.has_fingerprints = "fprint" in self._sections
+
+        self._columns = {}
+        for col in STRING_COLUMNS:
+            self._columns[col] = self._string_column(self._sections[section_name(col)])
+        if "notes" in self._sections:
+            self._columns["notes"] = self._string_column(self._sections["notes"])
+
+        if "fileidx" in self._sections:
+            self._file_index = self._sections["fileidx"]
+        else:
+            self._file_index = self._build_file_index()
+
+    @staticmethod
+    def _string_column(buf):
+        (ndict,) = struct.unpack_from("<I", buf, 0)
+        blob_at = 4 + 4 * (ndict + 1)
+        (blob_len,) = struct.unpack_from("<I", buf, 4 + 4 * ndict)
+        codes_at = blob_at + blob_len
+        codes_at += -codes_at % 4
+        return (buf, ndict, blob_at, codes_at, {})
+
+    def _build_file_index(self):
+        ndict = self._columns["fname"][1]
+        codes = [self.code("fname", row) for row in range(self.nbugs)]
+        return memoryview(encode_file_index(ndict, codes))
+
+    def code(self, col, row):
+        buf, _, _, codes_at, _ = self._columns[col]
+        return struct.unpack_from("<I", buf, codes_at + 4 * row)[0]
+
+    def string(self, col, code):
+        buf, _, blob_at, _, cache = self._columns[col]
+        value = cache.get(code)
+        if value is None:
+            start, end = struct.unpack_from("<II", buf, 4 + 4 * code)
+            value = bytes(buf[blob_at + start:blob_at + end]).decode("utf-8", "surrogatepass")
+            cache[code] = value
+        return value
+
+    def value(self, col, row):
+        return self.string(col, self.code(col, row))
+
+    def locs(self, row):
+        return struct.unpack_from("<ii", self._sections["locs"], 8 * row)
+
+    def fingerprint(self, row):
+        """
+            return: the saved fingerprint of a row, or None for reports saved
+                    before fingerprints were stored
+        """
+        if not self.has_fingerprints:
+            return None
+        return struct.unpack_from("<Q", self._sections["fprint"], 8 * row)[0]
+
+    def notes(self, row):
+        """
+            return: the saved notes of a row, or None
+        """
+        if "notes" not in self._columns:
+            return None
+        return decode_notes(self.value("notes", row))
+
+    def fnames(self):
+        """
+            return: dictionary from fname to its dictionary code, for every
+                    fname with at least one bug
+        """
+        return {self.string("fname", c): c for c in range(self._columns["fname"][1])}
+
+    def rows_for(self, code):
+        """
+            return: the row numbers of the bugs whose fname has the given code
+        """
+        start, end = struct.unpack_from("<II", self._file_index, 4 * code)
+        rows_at = 4 * (self._columns["fname"][1] + 1)
+        return struct.unpack_from("<{}I".format(end - start), self._file_index, rows_at + 4 * start)
+
+    def close(self):
+        if self._mm is None:
+            return
+        for buf, _, _, _, _ in self._columns.values():
+            buf.release()
+        for view in self._sections.values():
+            view.release()
+        self._file_index.release()
+        self._columns = {}
+        self._sections = {}
+        self._mm.close()
+        self._f.close()
+        self._mm = None
@@ -0,0 +1,211 @@
+"""
+    Content-addressed cache of analysis results. Results are keyed by what
+    they were computed from (the tool, its version, its options and the
+    hash of the analyzed content: a commit's tree, a TU's preprocessed
+    source, ...) rather than by commit, so identical inputs in different
+    commits, worktrees or machines are only analyzed once.
+
+    Entries are files named by their key in a directory, written to a
+    temporary file and renamed into place so readers never see partial
+    entries. A LocalCache is bounded in size and evicts the least recently
+    used entries; a SharedCache lives on a shared filesystem and is never
+    evicted by us. TieredCache checks the local cache before the shared one.
+"""
+import functools
+import hashlib
+import os
+import subprocess
+
+DEFAULT_MAX_BYTES = 4 << 30
+
+
+def cache_key(*parts):
+    """
+        return: hex digest identifying a result computed from parts (strings
+                or bytes)
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if part is None:
+            part = b""
+        elif not isinstance(part, bytes):
+            part = str(part).encode("utf-8", "surrogateescape")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool):
+    try:
+        result = subprocess.run([tool, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return ""
+    return result.stdout.decode("utf-8", "replace").strip()
+
+
+class DirectoryCache:
+    """
+        Cache entries stored as <root>/<key[:2]>/<key>.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """
+            return: path of the entry for key, or None if there is none
+        """
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+    def get_bytes(self, key):
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # evicted by another process in the meantime
+            return None
+
+    def put(self, key, src):
+        """
+            Copies the file src into the cache under key.
+        """
+        with open(src, "rb") as f:
+            self.put_bytes(key, f.read())
+
+    def put_bytes(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+
+class LocalCache(DirectoryCache):
+    """
+        A cache on local disk holding at most max_bytes. Hits refresh an
+        entry's modification time, and when the cache outgrows its bound
+        the entries used least recently are removed.
+    """
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        DirectoryCache.__init__(self, root)
+        self.max_bytes = max_bytes
+        self._size = None
+
+    def get(self, key):
+        path = DirectoryCache.get(self, key)
+        if path is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                return None
+        return path
+
+    def _entries(self):
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if ".tmp" in name:
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(dirpath, name)))
+        return entries
+
+    def put_bytes(self, key, data):
+        path = DirectoryCache.put_bytes(self, key, data)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.evict()
+        return path
+
+    def evict(self):
+        """
+            Removes the least recently used entries until the cache fits in
+            max_bytes. Other processes may share the directory, so the size
+            is measured again rather than trusted.
+        """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+class SharedCache(DirectoryCache):
+    """
+        A cache on a filesystem shared by every machine. It is not evicted
+        here, and hits do not write to it.
+    """
+    pass
+
+
+class TieredCache:
+    """
+        A local cache in front of a shared one. Shared hits are copied into
+        the local cache and new results are written to both.
+    """
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        path = self.local.get(key)
+        if path is None:
+            shared = self.shared.get(key)
+            if shared is None:
+                return None
+            try:
+                self.local.put(key, shared)
+            except OSError:
+                return shared
+            path = self.local.path(key)
+        return path
+
+    def get_bytes(self, key):
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # evicted by another process in the meantime
+            return None
+
+    def put(self, key, src):
+        self.local.put(key, src)
+        self.shared.put(key, src)
+
+    def put_bytes(self, key, data):
+        self.local.put_bytes(key, data)
+        self.shared.put_bytes(key, data)
+
+
+def open_cache(local_dir=None, shared_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+        return: a cache over the given directories, or None if neither is set
+    """
+    local = LocalCache(local_dir, max_bytes) if local_dir is not None else None
+    shared = SharedCache(shared_dir) if shared_dir is not None else None
+    if local is not None and shared is not None:
+        return TieredCache(local, shared)
+    return local or shared
@@ -0,0 +1,203 @@
+"""
+    Bug lifetime tracking split by file across a process pool. Whether a
+    bug is resolved only depends on the changes made to its own file, so
+    the bugs are partitioned into shards by file and every shard walks the
+    whole snapshot list on its own.
+
+    Renames are what ties files together: the diff of every commit pair is
+    computed once up front, and files joined by a rename anywhere in the
+    history share a lineage, which is what is hashed to pick a shard. A
+    renamed bug therefore never leaves its shard. Each diff is then split
+    by shard into a temporary directory, so every shard reads the hunks of
+    its own files instead of diffing the whole repository again.
+
+    Every tracked bug carries a key (step, position of its file among the
+    step's changes, position in the file) that orders it as the single
+    process LifetimeTracker would, so merging the shards' EventsReports by
+    key gives the same result regardless of the number of shards.
+"""
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import zlib
+import numpy as np
+from datetime import timedelta
+from utility.event_report import EventsReport
+from utility.git_backend import get_backend
+from utility.git_diff import DiffIndex
+from utility.lifetime_tracker import LifetimeTracker
+from utility.report_diff import added_bugs
+
+
+class Lineages:
+    """
+        Union-find over file paths joined by renames. The representative
+        of a lineage is its smallest path, so it does not depend on the
+        order renames are added in.
+    """
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, path):
+        root = path
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while path != root:
+            self.parent[path], path = root, self.parent[path]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            if b < a:
+                a, b = b, a
+            self.parent[b] = a
+            self.parent.setdefault(a, a)
+
+    def shard(self, path, n):
+        return zlib.crc32(self.find(path).encode("utf-8", "surrogateescape")) % n
+
+
+class ShardTracker(LifetimeTracker):
+    """
+        A LifetimeTracker following only the files of one shard.
+
+        keys: the key of every bug of bug_list
+        diff_dir: directory split_diff wrote the shard's diffs to
+    """
+    def __init__(self, snapshots, bug_list, keys, report_args, shard, diff_dir):
+        LifetimeTracker.__init__(self, snapshots, bug_list, report_args, debug=False)
+        self.keys = keys
+        self.shard = shard
+        self.diff_dir = diff_dir
+
+    def diff(self, curr_commit, next_commit):
+        with open(_diff_path(self.diff_dir, self.step, self.shard), "rb") as f:
+            diff, self._positions = pickle.load(f)
+        return diff
+
+    def find_new_bugs(self, curr_br, new_br, f_changes):
+        new_bugs = []
+        for fname, change in f_changes.items():
+            added = added_bugs(curr_br, new_br, {fname: change})
+            self.keys += [(self.step, self._positions[fname], k) for k in range(len(added))]
+            new_bugs += added
+        return new_bugs
+
+
+_job = None
+
+def _init_worker(job):
+    global _job
+    _job = job
+
+def _diff_path(diff_dir, step, shard=None):
+    if shard is None:
+        return os.path.join(diff_dir, "{}.pkl".format(step))
+    return os.path.join(diff_dir, "{}.{}.pkl".format(step, shard))
+
+def _diff_pair(task):
+    """
+        Diffs a commit pair once and keeps the diff for split_diff.
+
+        return: the renames of the pair
+    """
+    step, curr_commit, next_commit, diff_dir = task
+    diff = get_backend().diff_index(curr_commit, next_commit)
+    with open(_diff_path(diff_dir, step), "wb") as f:
+        pickle.dump(diff, f, pickle.HIGHEST_PROTOCOL)
+    return diff.renames()
+
+def _split_diff(step):
+    """
+        Splits the diff of a step into one DiffIndex per shard, holding the
+        changes of the shard's files. The position of every file among all
+        the step's changes is kept with it, so keys from different shards
+        interleave as in a single process run.
+    """
+    lineages, shards, diff_dir = _job
+    path = _diff_path(diff_dir, step)
+    with open(path, "rb") as f:
+        diff = pickle.load(f)
+    parts = [(DiffIndex(diff.curr_commit, diff.next_commit), {}) for _ in range(shards)]
+    for pos, (fname, fd) in enumerate(diff.files.items()):
+        part = parts[lineages.shard(fname, shards)]
+        part[0].files[fname] = fd
+        part[1][fname] = pos
+    for shard, part in enumerate(parts):
+        with open(_diff_path(diff_dir, step, shard), "wb") as f:
+            pickle.dump(part, f, pickle.HIGHEST_PROTOCOL)
+    os.remove(path)
+
+def _track_shard(task):
+    shard, bug_list, keys = task
+    snapshots, report_args, diff_dir = _job
+    tracker = ShardTracker(snapshots, bug_list, keys, report_args, shard, diff_dir)
+    tracker.run()
+    return tracker.keys, tracker.er
+
+
+def merge_fragments(fragments, debug=True):
+    """
+        Merges the EventsReports of the shards into one, with the bugs in
+        key order.
+
+        fragments: list of (keys, EventsReport)
+    """
+    keys = [key for k, _ in fragments for key in k]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    bugs = [bug for _, er in fragments for bug in er.bug_list]
+    states = [er.state() for _, er in fragments]
+
+    er = EventsReport([bugs[i] for i in order], debug)
+    er.set_state({name: np.concatenate([state[name] for state in states])[order]
+                  for name in states[0]})
+    return er
+
+
+def track(snapshots, bug_list, report_args, workers=None, shards=None):
+    """
+        Tracks the lifetime of bug_list across snapshots like
+        LifetimeTracker.run, with the files split in shards across workers.
+
+        shards: number of shards, defaults to the number of workers
+        return: the merged EventsReport
+    """
+    start_time = time.time()
+    workers = workers or os.cpu_count()
+    shards = shards or workers
+
+    diff_dir = tempfile.mkdtemp(prefix="breezy-diffs-")
+    try:
+        steps = range(1, len(snapshots))
+        with multiprocessing.Pool(workers) as pool:
+            print("...Diffing {} commit pairs...".format(len(steps)))
+            pairs = [(i, snapshots[i - 1][1], snapshots[i][1], diff_dir) for i in steps]
+            lineages = Lineages()
+            for renames in pool.imap(_diff_pair, pairs):
+                for old, new in renames.items():
+                    lineages.union(old, new)
+
+        job = (lineages, shards, diff_dir)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(job,)) as pool:
+            pool.map(_split_diff, steps)
+
+        tasks = [(shard, [], []) for shard in range(shards)]
+        for i, bug in enumerate(bug_list):
+            task = tasks[lineages.shard(bug.fname, shards)]
+            task[1].append(bug)
+            task[2].append((0, 0, i))
+
+        job = (snapshots, report_args, diff_dir)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(job,)) as pool:
+            fragments = pool.map(_track_shard, tasks, chunksize=1)
+    finally:
+        shutil.rmtree(diff_dir, ignore_errors=True)
+
+    er = merge_fragments(fragments)
+    print("Tracked {} bugs in {} shards in {}".format(len(er.bug_list), shards,
+        str(timedelta(seconds=time.time() - start_time))))
+    return er
@@ -0,0 +1,192 @@
+"""
+    Per translation unit static analysis driven by a compilation database
+    (compile_commands.json). Every TU is analyzed on its own across a
+    process pool, and its findings are kept in a result_cache under a hash
+    of its preprocessed source, its flags and the analyzer's version, so a
+    TU that is unchanged from an earlier commit, in any worktree, is never
+    analyzed again.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shlex
+import subprocess
+import tempfile
+from utility import format_plist
+from utility import result_cache
+from utility.bug_report import CPPCHECK_START, CPPCHECK_SEP, CPPCHECK_TEMPLATE
+
+# Flags that only concern the output of a compile and not what it sees
+OUTPUT_FLAGS = {"-o", "-MF", "-MT", "-MQ"}
+DEP_FLAGS = {"-c", "-M", "-MM", "-MD", "-MMD", "-MG", "-MP"}
+WRAPPERS = {"ccache", "sccache", "distcc"}
+
+
+class TranslationUnit:
+    """
+        One entry of a compilation database.
+
+        compiler: the compiler the build used, without any ccache wrapper
+        flags: its flags, without the source file, outputs and dependency
+               file generation
+    """
+    def __init__(self, entry):
+        self.directory = entry['directory']
+        self.file = os.path.normpath(os.path.join(self.directory, entry['file']))
+        args = entry['arguments'] if 'arguments' in entry else shlex.split(entry['command'])
+        if os.path.basename(args[0]) in WRAPPERS:
+            args = args[1:]
+        self.compiler = args[0]
+
+        self.flags = []
+        skip = False
+        for arg in args[1:]:
+            if skip:
+                skip = False
+            elif arg in OUTPUT_FLAGS:
+                skip = True
+            elif arg in DEP_FLAGS or (arg.startswith("-o") and len(arg) > 2):
+                continue
+            elif os.path.normpath(os.path.join(self.directory, arg)) == self.file:
+                continue
+            else:
+                self.flags.append(arg)
+
+    def preprocess(self):
+        """
+            return: the preprocessed source, or None if it does not preprocess
+        """
+        result = subprocess.run([self.compiler] + self.flags + ["-E", self.file],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=self.directory)
+        return result.stdout if result.returncode == 0 else None
+
+    def key(self, tool, root):
+        """
+            return: the result_cache key of analyzing this TU with tool, or
+                    None if it does not preprocess. The repository path is
+                    taken out, so the same TU in two worktrees has the same
+                    key.
+        """
+        source = self.preprocess()
+        if source is None:
+            return None
+        prefix = (root.rstrip(os.sep) + os.sep).encode()
+        flags = "\0".join(self.flags).encode().replace(prefix, b"")
+        content = hashlib.blake2b(source.replace(prefix, b""), digest_size=20).hexdigest()
+        return result_cache.cache_key("tu", tool, result_cache.tool_version(tool), flags, content)
+
+    def cppcheck_flags(self):
+        flags = []
+        for i, arg in enumerate(self.flags):
+            if arg[:2] in ("-I", "-D", "-U") and len(arg) > 2:
+                flags.append(arg)
+            elif arg in ("-I", "-D", "-U") and i + 1 < len(self.flags):
+                flags.append(arg + self.flags[i + 1])
+            elif arg.startswith("-std="):
+                flags.append("--std=" + arg[len("-std="):].replace("gnu", "c"))
+        return flags
+
+
+def _relative(path, root):
+    path = os.path.normpath(path)
+    return os.path.relpath(path, root) if path.startswith(root + os.sep) else path
+
+def analyze_clang(tu, root):
+    """
+        return: list of findings, as (file, desc, code, bug type, severity, line)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "report.plist")
+        subprocess.run(["clang", "--analyze", "--analyzer-output", "plist", "-o", out]
+            + tu.flags + [tu.file], cwd=tu.directory,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not os.path.exists(out):
+            return []
+        bugs = format_plist.parse_plist(out, root)
+    return [(b['file'], b['desc'], b['code'], b['group'], b['type'], b['line']) for b in bugs]
+
+def analyze_cppcheck(tu, root):
+    """
+        return: list of findings, as (file, desc, code, bug type, severity, line)
+    """
+    result = subprocess.run(["cppcheck", "--enable=all", "--inconclusive", "--quiet",
+        "--template=" + CPPCHECK_TEMPLATE] + tu.cppcheck_flags() + [tu.file],
+        cwd=tu.directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    findings = []
+    for record in result.stderr.decode("utf-8", "replace").split(CPPCHECK_START)[1:]:
+        header, _, code = record.partition("\n")
+        fname, line_no, column, severity, bug_id, message = header.split(CPPCHECK_SEP, 5)
+        code = "".join(l for l in code.split("\n") if l.strip() != "^")
+        findings.append((_relative(os.path.join(tu.directory, fname), root),
+                         "{} [{}]".format(message, bug_id), code, severity, severity, int(line_no)))
+    return findings
+
+ANALYZERS = {"clang": analyze_clang, "cppcheck": analyze_cppcheck}
+
+
+_job = None
+
+def _init_worker(job):
+    global _job
+    _job = job
+
+def _analyze(entry):
+    tool, root, cache = _job
+    tu = TranslationUnit(entry)
+    key = tu.key(tool, root)
+    if key is not None:
+        data = cache.get_bytes(key)
+        if data is not None:
+            return [tuple(finding) for finding in json.loads(data.decode("utf-8"))], True
+    findings = ANALYZERS[tool](tu, root)
+    if key is not None:
+        cache.put_bytes(key, json.dumps(findings).encode("utf-8"))
+    return findings, False
+
+def _map_entries(job, entries, workers):
+    """
+        Yields the findings of every entry, in order. Within a worker of
+        worktree_pool, which is a daemon and cannot start a pool of its own,
+        the entries are analyzed one after the other.
+    """
+    if multiprocessing.current_process().daemon or workers == 1:
+        _init_worker(job)
+        for entry in entries:
+            yield _analyze(entry)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(job,)) as pool:
+        chunksize = max(1, len(entries) // (4 * (workers or os.cpu_count())))
+        for result in pool.imap(_analyze, entries, chunksize):
+            yield result
+
+def load_compile_commands(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def analyze(compile_commands, tool, root, cache, workers=None):
+    """
+        Analyzes every TU of a compilation database with tool ("clang" or
+        "cppcheck"). A bug in a header is found by every TU including it,
+        so findings are deduplicated, keeping the order of the database.
+
+        root: the repository, file names are made relative to it
+        cache: result_cache to keep the findings of every TU in
+        return: list of findings, as (file, desc, code, bug type, severity, line)
+    """
+    root = os.path.abspath(root)
+    entries = load_compile_commands(compile_commands)
+    job = (tool, root, cache)
+
+    findings = []
+    seen = set()
+    cached = 0
+    for tu_findings, hit in _map_entries(job, entries, workers):
+        cached += hit
+        for finding in tu_findings:
+            if finding not in seen:
+                seen.add(finding)
+                findings.append(finding)
+    print("...Analyzed {} translation units, {} from the cache...".format(len(entries), cached))
+    return findings
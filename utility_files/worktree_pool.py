@@ -0,0 +1,114 @@
+"""
+    Parallel bug report generation. Every worker process owns one git
+    worktree of the repository for its whole life and checks commits out
+    there, so N static analyzers run side by side without sharing a working
+    tree. Commits are handed out in contiguous chunks so a worker usually
+    moves forward a few commits at a time, which keeps rebuilds small.
+"""
+import math
+import multiprocessing
+import os
+import subprocess
+from utility.bug_report import BugReport
+from utility.report_manifest import get_manifest
+
+_worktree = None
+_options = None
+
+
+def _git(cwd, *args):
+    subprocess.run(["git"] + list(args), cwd=cwd, check=True,
+        stdout=subprocess.DEVNULL)
+
+def ensure_worktrees(repo_dir, root, n):
+    """
+        Creates (or reuses) n detached worktrees of repo_dir under root.
+
+        return: list of worktree paths
+    """
+    repo_dir = os.path.abspath(repo_dir)
+    root = os.path.abspath(root)
+    os.makedirs(root, exist_ok=True)
+    _git(repo_dir, "worktree", "prune")
+
+    result = subprocess.run(["git", "worktree", "list", "--porcelain"], cwd=repo_dir,
+        stdout=subprocess.PIPE, check=True)
+    existing = set(line[len("worktree "):] for line in result.stdout.decode("utf-8").split("\n")
+                   if line.startswith("worktree "))
+
+    paths = []
+    for k in range(n):
+        path = os.path.join(root, "wt{}".format(k))
+        if path not in existing:
+            print("...Creating worktree {}...".format(path))
+            _git(repo_dir, "worktree", "add", "--detach", "-f", path, "HEAD")
+        paths.append(path)
+    return paths
+
+def _init_worker(slots, options):
+    global _worktree, _options
+    _worktree = slots.get()
+    _options = options
+    os.chdir(_worktree)
+
+def _generate_chunk(chunk):
+    """
+        Generates the bug reports of a chunk of commits, oldest first, in
+        this worker's worktree.
+
+        return: list of (commit, number of bugs)
+    """
+    generated = []
+    br = None
+    for commit in chunk:
+        br = BugReport(commit, dir=_worktree, save_dir=_options['save_dir'],
+            tool=_options['tool'], command=_options['command'], clean=_options['clean'],
+            compile_bugs=True, prev_br=br if _options['incremental'] else None,
+            clang_format=_options['clang_format'], cache=_options['cache'])
+        if br.saved_file() is None:
+            _git(_worktree, "checkout", "-q", "--detach", "-f", commit)
+            print("[{}] Generating Bug Reports for Commit {}".format(os.path.basename(_worktree), commit[:5]))
+        br.get_bugs()
+        generated.append((commit, br.num_bugs()))
+    return generated
+
+def generate_parallel(repo_dir, commits, workers, save_dir, tool, command, clean,
+        worktree_root=None, chunks_per_worker=4, incremental=False, clang_format="html", cache=None):
+    """
+        Generates bug reports for commits across a pool of worker processes,
+        each with its own worktree. Reports are saved to save_dir as they
+        finish; commits that already have a saved report are skipped.
+
+        commits: commit hashes in the order they should be analyzed
+        worktree_root: directory holding the worktrees, defaults to a
+                       "<repo>-worktrees" directory next to the repository
+        incremental: analyze each commit of a chunk from the report of the
+                     one before it (see BugReport.cppcheck_incremental)
+        return: dictionary from commit to the number of bugs found
+    """
+    repo_dir = os.path.abspath(repo_dir)
+    if worktree_root is None:
+        worktree_root = repo_dir.rstrip(os.sep) + "-worktrees"
+    paths = ensure_worktrees(repo_dir, worktree_root, workers)
+
+    manager = multiprocessing.Manager()
+    slots = manager.Queue()
+    for path in paths:
+        slots.put(path)
+    # Build the manifest once before the workers start appending to it
+    get_manifest(save_dir)
+    options = {'save_dir': os.path.abspath(save_dir), 'tool': tool,
+               'command': command, 'clean': clean, 'incremental': incremental,
+               'clang_format': clang_format, 'cache': cache}
+
+    size = max(1, math.ceil(len(commits) / (workers * chunks_per_worker)))
+    chunks = [commits[i:i + size] for i in range(0, len(commits), size)]
+
+    results = {}
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(slots, options)) as pool:
+        for generated in pool.imap_unordered(_generate_chunk, chunks):
+            for commit, nbugs in generated:
+                results[commit] = nbugs
+            print("{}/{} bug reports done".format(len(results), len(commits)))
+    manager.shutdown()
+    return results
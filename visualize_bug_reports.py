@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 from git import Repo
+from utility.commit_index import CommitIndex
 import datetime
 
 def data_to_avg_time(data):
@@ -149,18 +150,11 @@ def visualize_commit_distribution(data, title):
 
     def get_repo_commits(repo):
         print("...getting commits...")
-        commits = []
-        for i, c in enumerate(repo.head.commit.iter_parents()):
-            if c.hexsha in res_commits:
-                commits.append(c)
-
-        #get set of commits in reverse order
-        commits.reverse()
-        return commits
+        index = CommitIndex(os.getcwd(), 'master')
+        return [[sha, int(t)] for sha, t in zip(index.shas, index.timestamps) if sha in res_commits]
     commits = get_repo_commits(repo)
     os.chdir("../breezy")
 
-    commits = [[c, int(c.committed_date)] for c in commits]
     commits = sorted(commits, key=lambda x: x[1])
     commits = [[c[0], datetime.datetime.fromtimestamp(c[1]).strftime('%c')] for c in commits]
     print(commits)